@@ -1,10 +1,15 @@
 #Large data array handling
 import numpy as np
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 #Baselining and curve fitting
 import pybaselines
 from scipy.optimize import curve_fit
+from scipy.ndimage import binary_dilation, gaussian_filter1d, maximum_filter1d, median_filter
+from scipy.spatial import cKDTree
 
+import Axis
 import Helper
 
 def stowed_arm_subtraction(y_data, noise_intensity):
@@ -17,7 +22,182 @@ def stowed_arm_subtraction(y_data, noise_intensity):
     new_y = y_data - noise_intensity
     return new_y
 
-def baselining(y_data, mhw, shw):
+def spatial_neighbours(n_points, positions=None, count=4):
+    """
+    Finds the closest points of every point of a map. Returns a (n_points, count) array of point indices. Points
+    are compared by their position when given, otherwise by their order in the scan, which follows the raster.
+
+    n_points: number of points in the map
+    positions: optional (n_points, 2) array of point positions (ex: az and el from spatial.csv)
+    count: number of neighbours of each point, limited to n_points - 1
+    """
+    count = min(count, n_points - 1)
+    if count < 1:
+        return np.zeros((n_points, 0), dtype=int)
+
+    #Without positions, the scan order is used as a one dimensional position
+    if positions is None:
+        positions = np.column_stack([np.arange(n_points), np.zeros(n_points)])
+    positions = np.asarray(positions, dtype=np.float64)
+
+    #Ask for one extra point since every point is its own closest match
+    _, neighbours = cKDTree(positions).query(positions, count + 1)
+    neighbours = np.asarray(neighbours).reshape(n_points, count + 1)
+
+    #Drop each point itself, which is not always the first match when positions repeat
+    is_self = neighbours == np.arange(n_points)[:, None]
+    is_self[is_self.sum(axis=1) == 0, -1] = True
+
+    return neighbours[~is_self].reshape(n_points, count)
+
+def warm_start_order(n_points, positions=None):
+    """
+    Plans the order to fit the points of a map in so each fit can start from the result of a nearby point. The
+    walk starts at the lowest point of the map and always steps to the closest point not fitted yet. Returns an
+    array of point indices in fitting order, and an array with the index of the closest already fitted point of
+    each point to seed its fit from, -1 for the first point.
+
+    n_points: number of points in the map
+    positions: optional (n_points, 2) array of point positions (ex: az and el from spatial.csv), the scan order
+               is used without it
+    """
+    if positions is None or n_points < 2:
+        order = np.arange(n_points)
+        return order, order - 1
+
+    positions = np.asarray(positions, dtype=np.float64)
+
+    #Greedy walk to the closest point that has not been visited
+    order = np.empty(n_points, dtype=int)
+    visited = np.zeros(n_points, dtype=bool)
+    current = int(np.lexsort((positions[:, 0], positions[:, 1]))[0])
+    for step in range(n_points):
+        order[step] = current
+        visited[current] = True
+        if step < n_points - 1:
+            distances = np.sum((positions - positions[current])**2, axis=1)
+            distances[visited] = np.inf
+            current = int(np.argmin(distances))
+
+    #Seed every point from its closest point earlier in the walk
+    seeds = np.full(n_points, -1)
+    for step in range(1, n_points):
+        point = order[step]
+        earlier = order[:step]
+        seeds[point] = earlier[np.argmin(np.sum((positions[earlier] - positions[point])**2, axis=1))]
+
+    return order, seeds
+
+def detect_cosmic_rays(y_data, neighbours, threshold=8, max_width=5):
+    """
+    Flags the channels of every spectrum of a map that hold a cosmic ray, in one pass over the whole map. A ray
+    is a narrow spike that stands out from both the median of the spectrum's spatial neighbours and the median of
+    the map by more than threshold times the spike noise of the spectrum, and that is taller than any broader
+    bump it sits on, which keeps the tops of real peaks from being flagged. Returns a boolean (n_points, n_channels)
+    mask that also covers the channel on each side of a spike.
+
+    y_data: (n_points, n_channels) array of spectrums, raw or with the stowed arm removed, float32 maps are
+            searched in float32
+    neighbours: (n_points, n_neighbours) array of neighbour point indices from spatial_neighbours
+    threshold: number of robust standard deviations a spike must stand out by
+    max_width: widest spike in channels, on each side of its top
+    """
+    spectrums = np.asarray(y_data)
+    if spectrums.dtype != np.float32:
+        spectrums = np.asarray(spectrums, dtype=np.float64)
+    if spectrums.size == 0:
+        return np.zeros(spectrums.shape, dtype=bool)
+
+    #Reference spectrums the rays are compared against, the neighbours and the whole map
+    references = [np.median(spectrums, axis=0)[None, :]]
+    if np.shape(neighbours)[1] > 0:
+        references.append(np.median(spectrums[neighbours], axis=1))
+
+    mask = np.ones(spectrums.shape, dtype=bool)
+    for reference in references:
+        #Height of each channel of the residual above its narrow surroundings
+        residual = spectrums - reference
+        spike = residual - median_filter(residual, size=(1, 2*max_width + 1), mode='nearest')
+
+        #Robust noise of the spike height of every spectrum
+        deviation = np.abs(spike - np.median(spike, axis=1, keepdims=True))
+        scale = 1.4826 * np.median(deviation, axis=1, keepdims=True)
+
+        mask &= spike > threshold * scale
+
+    #Only keep spikes taller than the broader bump they sit on in the spectrum itself, checked at the few
+    #candidate channels
+    points, channels = np.nonzero(mask)
+    n_channels = spectrums.shape[1]
+    surroundings = []
+    for width in (max_width, 3*max_width):
+        window = np.clip(channels[:, None] + np.arange(-width, width + 1), 0, n_channels - 1)
+        surroundings.append(np.median(spectrums[points[:, None], window], axis=1))
+    narrow, broad = surroundings
+    mask[points, channels] = spectrums[points, channels] - narrow > narrow - broad
+
+    return binary_dilation(mask, structure=np.ones((1, 3), dtype=bool))
+
+def ray_intervals(ray_mask):
+    """
+    Turns a ray mask into the intervals to replace with replace_cosmic_rays. Returns arrays of the point, lower
+    index and upper index of every run of flagged channels, where the lower and upper indices are the unflagged
+    channels just outside the run (-1 or n_channels at the edges of the spectrum).
+
+    ray_mask: boolean (n_points, n_channels) array flagging cosmic ray channels
+    """
+    ray_mask = np.asarray(ray_mask, dtype=bool)
+
+    #Runs start where a flagged channel follows an unflagged one and stop where the reverse happens
+    padded = np.zeros((ray_mask.shape[0], ray_mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = ray_mask
+    starts = np.diff(padded, axis=1)
+    points, lower = np.nonzero(starts == 1)
+    _, upper = np.nonzero(starts == -1)
+
+    return points, lower - 1, upper
+
+def replace_cosmic_rays(y_data, lower, upper, points=None):
+    """
+    Replaces any number of cosmic ray intervals across any number of spectrums with a straight line between the
+    channels on either side of each ray, the same replacement as the manual cosmic ray tool. Channels strictly
+    between lower and upper are replaced, and an interval that reaches the edge of a spectrum is filled with the
+    value on its other side. The line of every interval uses the values from before any replacement. Edits y_data
+    in place and returns it.
+
+    y_data: a single spectrum, or a (n_points, n_channels) array of spectrums
+    lower: index, or array of indices, of the channel just below each ray
+    upper: index, or array of indices, of the channel just above each ray
+    points: array with the point index of each interval when y_data holds several spectrums
+    """
+    spectrums = y_data if np.ndim(y_data) == 2 else y_data[None, :]
+    n_channels = spectrums.shape[1]
+    lower = np.atleast_1d(np.asarray(lower, dtype=int))
+    upper = np.atleast_1d(np.asarray(upper, dtype=int))
+    points = np.zeros(len(lower), dtype=int) if points is None else np.atleast_1d(np.asarray(points, dtype=int))
+
+    #Every channel to replace, with the interval it belongs to
+    lengths = np.maximum(upper - lower - 1, 0)
+    interval = np.repeat(np.arange(len(lengths)), lengths)
+    if len(interval) == 0:
+        return y_data
+    channels = lower[interval] + 1 + np.arange(len(interval)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    #Values on either side of each interval, the other side stands in past the edge of the spectrum
+    left_value = spectrums[points, np.clip(lower, 0, n_channels - 1)]
+    right_value = spectrums[points, np.clip(upper, 0, n_channels - 1)]
+    left_value, right_value = np.where(lower < 0, right_value, left_value), np.where(upper >= n_channels, left_value, right_value)
+
+    #Linear replacement (change in y/change in x)
+    slope = (right_value - left_value) / (upper - lower)
+    spectrums[points[interval], channels] = left_value[interval] + slope[interval] * (channels - lower[interval])
+
+    return y_data
+
+#Number of channels at the start of every spectrum that are zeroed before baselining
+BASELINE_ZEROED_CHANNELS = 60
+
+def baselining(y_data, mhw, shw, method="swima"):
     """
     Attempts to find a baseline of given data using pybaselines. Returns the baseline and spectrum with the
     baseline removed.
@@ -25,22 +205,238 @@ def baselining(y_data, mhw, shw):
     y_data: y-axis of the data, the spectrum intensity
     mhw: max half window, half window size for removing noise in spectrum
     shw: smooth half window, half window size for smoothing the baseline curve
+    method: name of the baseline algorithm in BASELINE_METHODS
     """
 
     #Store a local copy of the x and y data
     spectrum = y_data
     
     #Set the first few y values to 0 (prevents massive spikes from ruining baseline)
-    for i in range(60):
-        spectrum[i] = 0
+    spectrum[:BASELINE_ZEROED_CHANNELS] = 0
     
     #Generate a baseline using pybaselines and subtract it from the spectrum
-    baseline = pybaselines.smooth.swima(spectrum, max_half_window=mhw, smooth_half_window=shw)[0]
+    baseline = baseline_method(method)(_baseline_fitter(len(spectrum)), spectrum, mhw, shw)
     spectrum_baseline_removed = spectrum - baseline
         
     return baseline, spectrum_baseline_removed  
 
-def perform_peakfit(x_data, y_data, ind1, ind2, center):
+#Baseline algorithms that can be selected with the BASELINE_METHOD setting. Each takes a pybaselines fitter, the
+#spectrum, and the max and smooth half windows, and returns the baseline. The window based methods use the
+#SAMPLING and SMOOTHING settings as their half windows, the others use the pybaselines defaults.
+BASELINE_METHODS = {
+    "swima": lambda fitter, spectrum, mhw, shw: fitter.swima(spectrum, max_half_window=mhw, smooth_half_window=shw)[0],
+    "snip": lambda fitter, spectrum, mhw, shw: fitter.snip(spectrum, max_half_window=mhw, smooth_half_window=shw)[0],
+    "asls": lambda fitter, spectrum, mhw, shw: fitter.asls(spectrum)[0],
+    "arpls": lambda fitter, spectrum, mhw, shw: fitter.arpls(spectrum)[0],
+    "imodpoly": lambda fitter, spectrum, mhw, shw: fitter.imodpoly(spectrum)[0]
+}
+
+def register_baseline_method(name, function):
+    """
+    Adds a baseline algorithm that can be selected with the BASELINE_METHOD setting.
+
+    name: name used in Settings.csv, case insensitive
+    function: function taking a pybaselines fitter, spectrum, max half window and smooth half window that returns
+        the baseline
+    """
+    BASELINE_METHODS[name.lower()] = function
+
+def baseline_method(name):
+    """
+    Looks up a baseline algorithm by name. Returns the function from BASELINE_METHODS, raises a ValueError if there
+    is no method with that name.
+
+    name: name of the baseline algorithm, case insensitive
+    """
+    function = BASELINE_METHODS.get(str(name).lower())
+    if function is None:
+        raise ValueError(f"Unknown baseline method '{name}', expected one of: " + ", ".join(BASELINE_METHODS))
+
+    return function
+
+#Baseline fitters are reused between spectrums, one per thread since they keep state between calls. A fitter only
+#accepts spectrums of the length it first saw, so each thread keeps one per channel count.
+_fitters = threading.local()
+
+def _baseline_fitter(n_channels):
+    """
+    Returns the pybaselines fitter of the current thread for spectrums of a length, creating it on first use.
+
+    n_channels: number of channels in the spectrums the fitter will be used on
+    """
+    if not hasattr(_fitters, "fitters"):
+        _fitters.fitters = {}
+    if n_channels not in _fitters.fitters:
+        _fitters.fitters[n_channels] = pybaselines.Baseline()
+
+    return _fitters.fitters[n_channels]
+
+def _baseline_rows(y_data, mhw, shw, method="swima"):
+    """
+    Finds the baseline of every row of an array with this thread's fitter. Returns an array of baselines with
+    the same type as y_data.
+
+    y_data: (n_points, n_channels) array of spectrums with their first channels already zeroed
+    mhw: max half window, half window size for removing noise in spectrum
+    shw: smooth half window, half window size for smoothing the baseline curve
+    method: name of the baseline algorithm in BASELINE_METHODS
+    """
+    fitter = _baseline_fitter(np.shape(y_data)[-1])
+    function = baseline_method(method)
+
+    return np.array([function(fitter, spectrum, mhw, shw) for spectrum in y_data], dtype=y_data.dtype).reshape(np.shape(y_data))
+
+def baselining_batch(y_data, mhw, shw, workers=1, pool="thread", method="swima"):
+    """
+    Finds the baseline of every spectrum of a map, like calling baselining on each one. Returns a
+    (n_points, n_channels) array of baselines and one of spectrums with the baseline removed, both with the type
+    of y_data. The first channels of y_data are zeroed in place, as baselining does.
+
+    y_data: (n_points, n_channels) writable array of spectrum intensities
+    mhw: max half window, half window size for removing noise in spectrum
+    shw: smooth half window, half window size for smoothing the baseline curve
+    workers: number of threads or processes to split the spectrums across
+    pool: "thread" or "process", the kind of pool used when workers is more than 1
+    method: name of the baseline algorithm in BASELINE_METHODS, methods added with register_baseline_method are
+        only available to thread pools
+    """
+
+    #Check the method before starting any workers
+    baseline_method(method)
+
+    #Set the first few y values of every spectrum to 0 at once
+    y_data[:, :BASELINE_ZEROED_CHANNELS] = 0
+
+    #Split the spectrums into one contiguous chunk per worker
+    workers = max(1, min(workers, len(y_data)))
+    if workers == 1:
+        baselines = _baseline_rows(y_data, mhw, shw, method)
+    else:
+        chunks = np.array_split(y_data, workers)
+        executor_class = ProcessPoolExecutor if pool == "process" else ThreadPoolExecutor
+        with executor_class(max_workers=workers) as executor:
+            baselines = np.concatenate(list(executor.map(_baseline_rows, chunks, [mhw] * workers, [shw] * workers, [method] * workers)))
+
+    return baselines, y_data - baselines
+
+def gaussian_guess_batch(x_data, y_data, ind1, ind2, center, min_half_width=2):
+    """
+    Estimates the gaussian parameters of the peak in a window of every spectrum at once without any iterations.
+    The log of a gaussian is a parabola, so a parabola is fit to the log of the channels above half of the
+    highest one of each window, weighted by their squared intensity so the noisy low channels count for little.
+    Returns a (n_points, 3) array of (amplitude, mean, sigma) and a boolean array of which estimates are usable.
+    Points whose top channels do not curve down like a peak, only as a spike narrower than a channel, or so
+    slightly that the peak is wider than the window, like a flat window, get the default guess (maximum y-value,
+    center, 5 sigma).
+
+    x_data: x-axis of the data, the ramanshift
+    y_data: (n_points, n_channels) array of spectrum intensities, or a single spectrum
+    ind1: lower index of the range to search for a peak within
+    ind2: upper index of the range to search for a peak within
+    center: estimate for the center of our spectrum peak, used by the default guess
+    min_half_width: least number of channels on each side of the highest one to fit the parabola to
+    """
+
+    #Local constants
+    SIGMA_GUESS = 5
+
+    #Narrow down x and y values to the search window
+    ind = Axis.window(x_data, ind1, ind2)
+    ramanshift = np.asarray(x_data[ind], dtype=np.float64)
+    spectrums = np.asarray(np.atleast_2d(y_data)[:, ind], dtype=np.float64)
+    n_points, n_channels = spectrums.shape
+
+    #Default guess for every point, replaced wherever the parabola works out
+    top = np.argmax(spectrums, axis=1)
+    guess = np.column_stack([spectrums[np.arange(n_points), top], np.full(n_points, center, dtype=np.float64), np.full(n_points, SIGMA_GUESS, dtype=np.float64)])
+    if n_channels < 3:
+        return guess, np.zeros(n_points, dtype=bool)
+
+    #Channels of the unbroken run above half of the top channel, but at least min_half_width on each side of it
+    index = np.arange(n_channels)
+    below = spectrums < guess[:, :1] / 2
+    left = np.max(np.where(below & (index < top[:, None]), index, -1), axis=1)
+    right = np.min(np.where(below & (index > top[:, None]), index, n_channels), axis=1)
+    left = np.minimum(left, top - min_half_width - 1)
+    right = np.maximum(right, top + min_half_width + 1)
+    in_peak = (index > left[:, None]) & (index < right[:, None])
+
+    #Positions are measured from the top channel to keep the fit well conditioned
+    u = ramanshift - ramanshift[top][:, None]
+
+    #Weighted least squares of log(y) = c0 + c1 u + c2 u^2, channels at or below zero have no log and get no weight
+    positive = in_peak & (spectrums > 0)
+    weights = np.where(positive, spectrums, 0)**2
+    log_y = np.log(np.where(positive, spectrums, 1))
+    powers = u[:, :, None]**np.arange(3)
+    normal = np.einsum('pk,pki,pkj->pij', weights, powers, powers)
+    rhs = np.einsum('pk,pki,pk->pi', weights, powers, log_y)
+
+    #A parabola needs three distinct channels, the rest keep the default guess
+    solvable = np.sum(positive, axis=1) >= 3
+    coefficients = np.zeros((n_points, 3))
+    coefficients[solvable] = np.linalg.solve(normal[solvable], rhs[solvable][:, :, None])[:, :, 0]
+    c0, c1, c2 = coefficients.T
+
+    #Only a parabola that curves down is a peak, its vertex has to stay inside the fit channels
+    valid = solvable & (c2 < 0)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        offset = -c1 / (2 * c2)
+        sigma = np.sqrt(-1 / (2 * c2))
+        amplitude = np.exp(c0 - c1**2 / (4 * c2))
+    reach = np.max(np.where(positive, np.abs(u), 0), axis=1)
+    valid &= np.isfinite(amplitude) & (np.abs(offset) <= reach)
+
+    #A peak narrower than the channel spacing is a spike like a cosmic ray, not something to start a fit from
+    valid &= sigma >= np.median(np.diff(ramanshift))
+
+    #A peak wider than the window is a nearly flat window curved by rounding, not a peak
+    valid &= sigma <= ramanshift[-1] - ramanshift[0]
+
+    guess[valid, 0] = amplitude[valid]
+    guess[valid, 1] = ramanshift[top][valid] + offset[valid]
+    guess[valid, 2] = sigma[valid]
+
+    return guess, valid
+
+def gaussian_guess(x_data, y_data, ind1, ind2, center, min_half_width=2):
+    """
+    Estimates the gaussian parameters of the peak in the window of a single spectrum with gaussian_guess_batch.
+    Returns a list of (amplitude, mean, sigma) to start a fit from.
+
+    x_data: x-axis of the data, the ramanshift
+    y_data: y-axis of the data, the spectrum intensity
+    ind1: lower index of the range to search for a peak within
+    ind2: upper index of the range to search for a peak within
+    center: estimate for the center of our spectrum peak, used if the spectrum has no peak shape
+    min_half_width: least number of channels on each side of the highest one to fit the parabola to
+    """
+    guess, _ = gaussian_guess_batch(x_data, y_data, ind1, ind2, center, min_half_width)
+
+    return list(guess[0])
+
+def double_gaussian_guess(x_data, y_data, ind1, ind2, focus_center, other_center):
+    """
+    Estimates the parameters of two neighbouring gaussian peaks by splitting the window halfway between their
+    expected centers and running gaussian_guess on each side. Returns a list of (amplitude, mean, sigma) for the
+    focus peak followed by (amplitude, mean, sigma) for the other peak, the order perform_double_peakfit takes.
+    Unlike the single peak guess this does not make the double fit faster, each side only sees part of its peak,
+    and the fit can settle a few percent away from the one started from the default guess.
+
+    x_data: x-axis of the data, the ramanshift
+    y_data: y-axis of the data, the spectrum intensity
+    ind1: lower index of the range to search for the peaks within
+    ind2: upper index of the range to search for the peaks within
+    focus_center: estimate for the center of our focused spectrum peak
+    other_center: estimate for the center of our other spectrum peak
+    """
+    middle = (focus_center + other_center) / 2
+    if focus_center < other_center:
+        return gaussian_guess(x_data, y_data, ind1, middle, focus_center) + gaussian_guess(x_data, y_data, middle, ind2, other_center)
+
+    return gaussian_guess(x_data, y_data, middle, ind2, focus_center) + gaussian_guess(x_data, y_data, ind1, middle, other_center)
+
+def perform_peakfit(x_data, y_data, ind1, ind2, center, p0=None, fit_info=None):
     """
     Attempts to fit a gaussian distribution to the given spectrum. Will return a tuple of fit parameters
     (amplitude, mean, sigma), full width at half max, R squared, and the covariance matrix if the fitting is 
@@ -51,6 +447,9 @@ def perform_peakfit(x_data, y_data, ind1, ind2, center):
     ind1: lower index of the range to search for a peak within
     ind2: upper index of the range to search for a peak within
     center: estimate for the center of our spectrum peak
+    p0: optional initial guess (amplitude, mean, sigma) to start the fit from instead of the default one
+    fit_info: optional dictionary that gets the number of function evaluations of the fit as "nfev" and whether
+              it failed as "failed", failed fits do not report their evaluations and get 0
     """
 
     #Local constants
@@ -59,19 +458,27 @@ def perform_peakfit(x_data, y_data, ind1, ind2, center):
     R_SQUARED_CALC_RANGE = 2
     
     #Narrow down x and y values to ones surrounding the peak
-    ind = (x_data > ind1) & (x_data < ind2)
+    ind = Axis.window(x_data, ind1, ind2)
     ramanshift = x_data[ind]
     spectrum = y_data[ind]
     
     #Initial guess for gaussian fit parameters (maximum y-value, expected mineral center, 5 sigma)
-    p0 = [np.max(spectrum), center, SIGMA_GUESS]
+    if p0 is None:
+        p0 = [np.max(spectrum), center, SIGMA_GUESS]
     
     #Try to fit the curve to our data and store parameters if it works
     try:
-        params, cov = curve_fit(Helper.gauss, ramanshift, spectrum, p0=p0)
+        if fit_info is None:
+            params, cov = curve_fit(Helper.gauss, ramanshift, spectrum, p0=p0, jac=Helper.gauss_jacobian)
+        else:
+            params, cov, infodict, _, _ = curve_fit(Helper.gauss, ramanshift, spectrum, p0=p0, jac=Helper.gauss_jacobian, full_output=True)
+            fit_info["nfev"], fit_info["failed"] = infodict["nfev"], False
     except:
         params = [0, 0, 0]
         cov = np.zeros((3, 3))
+        if fit_info is not None:
+            #curve_fit does not report how far a failed fit got, so failures are only counted
+            fit_info["nfev"], fit_info["failed"] = 0, True
 
     #Extract the fitted curve parameters and caluclate full width at half maximum (FWHM)
     fit_a = params[0]
@@ -80,7 +487,7 @@ def perform_peakfit(x_data, y_data, ind1, ind2, center):
     FWHM = WIDTH_APPROXIMATION * fit_sigma
     
     #Narrow down x and y values to ones surrounding the peak
-    ind_fit = (x_data > fit_mu - fit_sigma*R_SQUARED_CALC_RANGE) & (x_data < fit_mu + fit_sigma*R_SQUARED_CALC_RANGE)
+    ind_fit = Axis.window(x_data, fit_mu - fit_sigma*R_SQUARED_CALC_RANGE, fit_mu + fit_sigma*R_SQUARED_CALC_RANGE, cache=False)
     peak_ramanshift = x_data[ind_fit]
     peak_spectrum = y_data[ind_fit]
     
@@ -95,7 +502,175 @@ def perform_peakfit(x_data, y_data, ind1, ind2, center):
         
     return params, FWHM, r_squared, cov
 
-def perform_double_peakfit(x_data, y_data, ind1, ind2, focus_center, other_center):
+def perform_peakfit_batch(x_data, y_data, ind1, ind2, center, max_iterations=100, p0=None):
+    """
+    Fits a gaussian distribution to every spectrum of a map at once using vectorized Levenberg-Marquardt steps.
+    Matches perform_peakfit for each spectrum with a peak within the fit tolerance, spectrums of only noise have
+    no well defined minimum and can end on a different fit. Returns arrays of fit parameters
+    (n_points, 3), full width at half max (n_points,), R squared (n_points,), and covariance matrices
+    (n_points, 3, 3). Spectrums that have not converged after max_iterations are fit with curve_fit instead,
+    and get all zeros if that fails too, like a failed perform_peakfit.
+
+    x_data: x-axis of the data, the ramanshift
+    y_data: (n_points, n_channels) array of spectrum intensities
+    ind1: lower index of the range to search for a peak within
+    ind2: upper index of the range to search for a peak within
+    center: estimate for the center of our spectrum peak
+    max_iterations: number of vectorized iterations before the remaining spectrums are fit one at a time
+    p0: optional (n_points, 3) array of initial guesses (amplitude, mean, sigma) instead of the default one (ex:
+        from gaussian_guess_batch)
+    """
+
+    #Local constants, tolerances match the curve_fit defaults
+    SIGMA_GUESS = 5
+    WIDTH_APPROXIMATION = 2.35
+    R_SQUARED_CALC_RANGE = 2
+    TOLERANCE = 1.49012e-08
+    INITIAL_DAMPING = 1e-3
+    MAX_DAMPING = 1e16
+
+    #Narrow down x and y values to ones surrounding the peak
+    ind = Axis.window(x_data, ind1, ind2)
+    ramanshift = x_data[ind]
+    #Only the window is converted to double precision, the fit always runs in it
+    spectrum = np.asarray(np.asarray(y_data)[:, ind], dtype=np.float64)
+    n_points, n_channels = spectrum.shape
+
+    #Initial guess for gaussian fit parameters (maximum y-value, expected mineral center, 5 sigma)
+    if p0 is None:
+        params = np.empty((n_points, 3))
+        params[:, 0] = np.max(spectrum, axis=1)
+        params[:, 1] = center
+        params[:, 2] = SIGMA_GUESS
+    else:
+        params = np.array(p0, dtype=np.float64).reshape(n_points, 3)
+    initial = params.copy()
+
+    def residuals_and_jacobian(p, y):
+        #Evaluate the gaussian and its derivatives with respect to (amplitude, mean, sigma) for each spectrum
+        jacobian = Helper.gauss_jacobian(ramanshift, p[:, 0:1], p[:, 1:2], p[:, 2:3])
+        return y - p[:, 0:1] * jacobian[..., 0], jacobian
+
+    residuals, jacobian = residuals_and_jacobian(params, spectrum)
+    cost = np.sum(residuals**2, axis=1)
+    damping = np.full(n_points, INITIAL_DAMPING)
+    active = np.isfinite(cost)
+    converged = np.zeros(n_points, dtype=bool)
+    
+    for _ in range(max_iterations):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+
+        #Solve the damped normal equations of every active spectrum at once
+        J = jacobian[idx]
+        A = np.einsum('nmi,nmj->nij', J, J)
+        g = np.einsum('nmi,nm->ni', J, residuals[idx])
+        diagonal = np.diagonal(A, axis1=1, axis2=2)
+        scale = np.maximum(diagonal, 1e-12 * np.max(diagonal, axis=1, keepdims=True) + 1e-300)
+        M = A + damping[idx, None, None] * (scale[:, :, None] * np.eye(3))
+        solvable = np.all(np.isfinite(M), axis=(1, 2)) & np.all(np.isfinite(g), axis=1)
+        M[~solvable] = np.eye(3)
+        g[~solvable] = 0
+        step = np.linalg.solve(M, g[..., None])[..., 0]
+
+        #Evaluate the trial parameters and keep the ones that lower the cost without flipping the sign of sigma,
+        #the gaussian is symmetric in sigma so a flip only ever jumps to a mirrored solution
+        trial = params[idx] + step
+        trial_residuals, trial_jacobian = residuals_and_jacobian(trial, spectrum[idx])
+        trial_cost = np.sum(trial_residuals**2, axis=1)
+        accept = solvable & np.isfinite(trial_cost) & (trial_cost <= cost[idx]) & (np.sign(trial[:, 2]) == np.sign(params[idx, 2]))
+
+        #Actual and predicted relative reductions in cost and the relative step size decide convergence, like
+        #MINPACK's ftol and xtol tests
+        safe_cost = np.where(cost[idx] > 0, cost[idx], 1)
+        reduction = (cost[idx] - trial_cost) / safe_cost
+        scaled_step = np.einsum('ni,ni->n', step**2, scale)
+        predicted = (np.sum(np.einsum('nmi,ni->nm', J, step)**2, axis=1) + 2 * damping[idx] * scaled_step) / safe_cost
+        small_reduction = (np.abs(reduction) <= TOLERANCE) & (predicted <= TOLERANCE) & (reduction <= 2 * predicted)
+        small_step = np.sqrt(scaled_step) <= TOLERANCE * np.sqrt(np.einsum('ni,ni->n', params[idx]**2, scale))
+        done = accept & (small_reduction | small_step | (trial_cost == 0))
+
+        accepted = idx[accept]
+        params[accepted] = trial[accept]
+        residuals[accepted] = trial_residuals[accept]
+        jacobian[accepted] = trial_jacobian[accept]
+        cost[accepted] = trial_cost[accept]
+
+        #Trust the quadratic model more when the cost drops as much as predicted, less when it does not
+        ratio = np.where(predicted > 0, reduction / np.where(predicted > 0, predicted, 1), 0)
+        damping[idx] = damping[idx] * np.where(~accept, 10, np.where(ratio > 0.75, 1 / 3, np.where(ratio < 0.25, 2, 1)))
+
+        #Spectrums whose damping blows up cannot be improved any further and are at their minimum
+        stalled = ~accept & solvable & (damping[idx] > MAX_DAMPING)
+        converged[idx[done | stalled]] = True
+        active[idx[done | stalled | ~solvable]] = False
+
+    #Covariance from the jacobian at the solution, scaled by the residual variance like curve_fit
+    cov = np.zeros((n_points, 3, 3))
+    ok = np.flatnonzero(converged)
+    if ok.size > 0:
+        _, singular_values, VT = np.linalg.svd(jacobian[ok], full_matrices=False)
+        threshold = np.finfo(float).eps * max(jacobian.shape[1:]) * singular_values[:, :1]
+        inverse_squares = np.where(singular_values > threshold, 1 / np.where(singular_values > threshold, singular_values, 1)**2, 0)
+        cov[ok] = np.einsum('nki,nk,nkj->nij', VT, inverse_squares, VT)
+        if n_channels > 3:
+            cov[ok] *= (cost[ok] / (n_channels - 3))[:, None, None]
+        else:
+            cov[ok] = np.inf
+
+    #Fit the few spectrums that did not converge in time one at a time, failed fits return all zeros
+    for i in np.flatnonzero(~converged):
+        try:
+            params[i], cov[i] = curve_fit(Helper.gauss, ramanshift, spectrum[i], p0=initial[i], jac=Helper.gauss_jacobian)
+        except:
+            params[i] = 0
+            cov[i] = 0
+
+    FWHM = WIDTH_APPROXIMATION * params[:, 2]
+
+    #R squared only needs the fit window for fits whose two sigma range lies inside it, the whole axis is only
+    #searched for the others
+    fit_low = params[:, 1] - R_SQUARED_CALC_RANGE * params[:, 2]
+    fit_high = params[:, 1] + R_SQUARED_CALC_RANGE * params[:, 2]
+    inside = (fit_low >= ind1) & (fit_high <= ind2)
+    r_squared = np.zeros(n_points)
+    r_squared[inside] = calculate_r_squared_batch(ramanshift, spectrum[inside], params[inside])
+    if not np.all(inside):
+        r_squared[~inside] = calculate_r_squared_batch(x_data, np.asarray(y_data)[~inside], params[~inside])
+
+    return params, FWHM, r_squared, cov
+
+def calculate_r_squared_batch(x_data, y_data, params):
+    """
+    Calculates R squared of a gaussian fit for every spectrum of a map, using the points within two sigma of each
+    fitted mean like perform_peakfit. Returns an array with one value per spectrum, 0 where it cannot be computed.
+
+    x_data: x-axis of the data, the ramanshift
+    y_data: (n_points, n_channels) array of spectrum intensities
+    params: (n_points, 3) array of gaussian fit parameters (amplitude, mean, sigma)
+    """
+
+    #Local constants
+    R_SQUARED_CALC_RANGE = 2
+
+    fit_a, fit_mu, fit_sigma = params[:, 0:1], params[:, 1:2], params[:, 2:3]
+
+    #Narrow down x and y values to ones surrounding each peak
+    ind_fit = (x_data > fit_mu - fit_sigma*R_SQUARED_CALC_RANGE) & (x_data < fit_mu + fit_sigma*R_SQUARED_CALC_RANGE)
+    counts = np.sum(ind_fit, axis=1)
+
+    #Calculate R-Squared over the masked points only
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        residuals = np.where(ind_fit, y_data - Helper.gauss(x_data, fit_a, fit_mu, fit_sigma), 0)
+        means = np.sum(np.where(ind_fit, y_data, 0), axis=1) / np.maximum(counts, 1)
+        ss_res = np.sum(residuals**2, axis=1)
+        ss_tot = np.sum(np.where(ind_fit, y_data - means[:, None], 0)**2, axis=1)
+        r_squared = np.where((counts > 0) & (ss_tot != 0), 1 - ss_res / np.where(ss_tot != 0, ss_tot, 1), 0)
+
+    return r_squared
+
+def perform_double_peakfit(x_data, y_data, ind1, ind2, focus_center, other_center, p0=None):
     """
     Attempts to fit a double gaussian distribution to the given spectrum. Will return tuples of fit parameters
     (amplitude, mean, sigma) for the focus peak, (amplitude, mean, sigma) for the other peak, 
@@ -108,6 +683,8 @@ def perform_double_peakfit(x_data, y_data, ind1, ind2, focus_center, other_cente
     ind2: upper index of the range to search for a peak within
     focus_center: estimate for the center of our focused spectrum peak
     other_center: estimate for the center of our other spectrum peak
+    p0: optional initial guess (amplitude, mean, sigma) of the focus peak followed by the other peak instead of the
+        default one (ex: from double_gaussian_guess)
     """
 
     #Local constants
@@ -126,16 +703,19 @@ def perform_double_peakfit(x_data, y_data, ind1, ind2, focus_center, other_cente
         focus_left = True
     
     #Isolate the values that fit within the specified indices and truncate both x and y to only include that data
-    ind_fit = (x_data > ind1) & (x_data < ind2)
+    ind_fit = Axis.window(x_data, ind1, ind2)
     ramanshift = x_data[ind_fit]
     spectrum = y_data[ind_fit]
    
     #Initial guess for double gaussian fit parameters (maximum y-value, expected carbonate center, 10 sigma)
-    p0 = [np.max(spectrum), center1, SIGMA_GUESS, np.max(spectrum), center2, SIGMA_GUESS]
+    if p0 is None:
+        p0 = [np.max(spectrum), center1, SIGMA_GUESS, np.max(spectrum), center2, SIGMA_GUESS]
+    elif not focus_left:
+        p0 = list(p0[3:]) + list(p0[:3])
     
     #Try to fit the curve to our data and store parameters if it works
     try:
-        params, cov = curve_fit(Helper.double_gauss, ramanshift, spectrum, p0=p0)
+        params, cov = curve_fit(Helper.double_gauss, ramanshift, spectrum, p0=p0, jac=Helper.double_gauss_jacobian)
     except:
         params = [0, 0, 0, 0, 0, 0]
         cov = np.zeros((6, 6))
@@ -152,7 +732,7 @@ def perform_double_peakfit(x_data, y_data, ind1, ind2, focus_center, other_cente
     FWHM2 = WIDTH_APPROXIMATION * fit_sigma2
     
     #Narrow down x and y values to ones surrounding the peak
-    ind_fit = (x_data > fit_mu1 - fit_sigma1*R_SQUARED_CALC_RANGE) & (x_data < fit_mu2 + fit_sigma2*R_SQUARED_CALC_RANGE)
+    ind_fit = Axis.window(x_data, fit_mu1 - fit_sigma1*R_SQUARED_CALC_RANGE, fit_mu2 + fit_sigma2*R_SQUARED_CALC_RANGE, cache=False)
     peak_ramanshift = x_data[ind_fit]
     peak_spectrum = y_data[ind_fit]
     
@@ -170,6 +750,23 @@ def perform_double_peakfit(x_data, y_data, ind1, ind2, focus_center, other_cente
     else:
         return [fit_a2, fit_mu2, fit_sigma2], [fit_a1, fit_mu1, fit_sigma1], FWHM2, r_squared, cov[3:, 3:]
 
+def calculate_noise_stowed_arm(x_data, noise_intensity, center):
+    """
+    Calculates and returns the standard deviation of a stowed arm noise scan around the peak center. Accepts a
+    single noise spectrum or a (n_points, n_channels) array, in which case one value is returned per point.
+
+    x_data: x-axis of the data, the ramanshift
+    noise_intensity: numpy array of noise, or array of noise spectrums
+    center: location of the peak center
+    """
+
+    #Narrow the noise down to the region around our scan
+    ind_SNR = Axis.window(x_data, max(center - 200, 700), center + 200)
+    noise = np.asarray(noise_intensity)[..., ind_SNR]
+
+    #Calculate standard deviation of the noise
+    return np.std(noise, axis=-1)
+
 def calculate_SNR_stowed_arm(x_data, noise_intensity, fit_a, center):
     """
     Calculates and returns the signal-to-noise ratio for the given data using a stowed arm noise scan.
@@ -180,16 +777,28 @@ def calculate_SNR_stowed_arm(x_data, noise_intensity, fit_a, center):
     center: location of the peak center
     """
     
-    #Narrow the noise down to the region around our scan
-    ind_SNR = (x_data > max(center - 200, 700)) & (x_data < center + 200)
-    noise = noise_intensity[ind_SNR]
-    
     #Calculate standard deviation of the noise and use it to find signal-noise ratio
-    sigmay = np.std(noise)
+    sigmay = calculate_noise_stowed_arm(x_data, noise_intensity, center)
     SNR = fit_a / sigmay
         
     return SNR
 
+def calculate_noise_silent_region(x_data, y_data):
+    """
+    Calculates and returns the standard deviation of a spectrum in the silent region. Accepts a single spectrum
+    or a (n_points, n_channels) array, in which case one value is returned per point.
+
+    x_data: x-axis of the data, the ramanshift
+    y_data: y-axis of the data, the spectrum intensity, or array of spectrums
+    """
+
+    #Isolate all x values that fall within the silent region
+    ind_silent = Axis.window(x_data, 2000, 2100)
+    spectrum = np.asarray(y_data)[..., ind_silent]
+
+    #Calculate standard deviation of the noise
+    return np.std(spectrum, axis=-1)
+
 def calculate_SNR_silent_region(x_data, y_data, fit_a):
     """
     Calculates and returns the signal-to-noise ratio for the given data using the silent region.
@@ -199,12 +808,99 @@ def calculate_SNR_silent_region(x_data, y_data, fit_a):
     fit_a: amplitude of our normal curve we want to compare the noise to
     """
     
-    #Isolate all x values that fall within the silent region
-    ind_silent = (x_data > 2000) & (x_data < 2100)
-    spectrum = y_data[ind_silent]
-    
     #Calculate standard deviation of the noise and use it to find signal-noise ratio
-    sigmay = np.std(spectrum)
+    sigmay = calculate_noise_silent_region(x_data, y_data)
     SNR = fit_a / sigmay
         
-    return SNR
\ No newline at end of file
+    return SNR
+
+def find_peaks_batch(x_data, y_data, snr_threshold, low=250, high=4000, min_separation=20, min_width=20, max_width=120):
+    """
+    Finds every significant peak of every baseline removed spectrum of a map at once. Spectrums are lightly
+    smoothed first, and a peak is a channel that is the maximum of its neighbourhood with a smoothed height of at
+    least snr_threshold times the smoothed silent region noise of its point. Smoothing lowers the noise more than
+    it lowers a real peak, so this SNR is higher than the one of a fit for the same peak. The center and height
+    are refined with a parabola through the top three channels and the full width at half max is measured from
+    the half height crossings of the smoothed peak. Peaks narrower than min_width, like cosmic rays, are dropped.
+    Returns arrays of the point index, center, height, full width at half max and smoothed SNR of each peak,
+    sorted by point then center. Widths are NaN where the peak does not drop to half its height within max_width
+    of its center.
+
+    x_data: x-axis of the data, the ramanshift
+    y_data: (n_points, n_channels) array of baseline removed spectrums
+    snr_threshold: minimum smoothed height over smoothed noise of a significant peak
+    low: lower ramanshift bound of the search, excluded
+    high: upper ramanshift bound of the search, excluded
+    min_separation: ramanshift distance two peaks of the same point must be apart, the highest one is kept
+    min_width: smallest full width at half max of a significant peak
+    max_width: ramanshift distance from the center searched for each half height crossing
+    """
+
+    #Local constants
+    WIDTH_APPROXIMATION = 2.35
+
+    #Narrow down x and y values to the search range
+    ind = Axis.window(x_data, low, high)
+    ramanshift = np.asarray(x_data)[ind]
+    spectrums = np.asarray(np.asarray(y_data)[:, ind], dtype=np.float64)
+    n_channels = spectrums.shape[1]
+    if n_channels < 3 or len(spectrums) == 0:
+        empty = np.zeros(0)
+        return np.zeros(0, dtype=int), empty, empty, empty, empty
+    spacing = np.median(np.diff(ramanshift))
+
+    #Peaks are found on a lightly smoothed copy so noise on top of a broad peak is not split into several peaks,
+    #the whole spectrum is smoothed so the silent region noise can be measured the same way
+    size = 2 * max(int(round(min_separation / spacing / 2)), 1) + 1
+    smoothed_full = gaussian_filter1d(np.asarray(y_data, dtype=np.float64), min_separation / WIDTH_APPROXIMATION / spacing / 2, axis=1, mode='nearest')
+    smoothed = smoothed_full[:, ind]
+    noise_std = calculate_noise_silent_region(x_data, smoothed_full)
+
+    #Peaks are the highest channel within min_separation, the first of equal channels, and above the noise
+    is_peak = smoothed == maximum_filter1d(smoothed, size, axis=1, mode='nearest')
+    is_peak[:, 1:] &= smoothed[:, 1:] != smoothed[:, :-1]
+    is_peak[:, [0, -1]] = False
+    with np.errstate(divide='ignore', invalid='ignore'):
+        is_peak &= smoothed >= snr_threshold * noise_std[:, None]
+        is_peak &= (spectrums > 0) & (smoothed > 0)
+    points, channels = np.nonzero(is_peak)
+
+    #Refine the center and height with a parabola through the top three channels of the original spectrum
+    left = spectrums[points, channels - 1]
+    top = spectrums[points, channels]
+    right = spectrums[points, channels + 1]
+    curvature = left - 2*top + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0)
+    offset = np.clip(offset, -0.5, 0.5)
+    position = channels + offset
+    center = np.interp(position, np.arange(n_channels), ramanshift)
+    height = top - 0.25 * (left - right) * offset
+
+    #Find the first channel on each side of the smoothed peak below half its height and interpolate the crossing
+    reach = np.arange(1, max(int(np.ceil(max_width / spacing)), 1) + 1)
+    smoothed_top = smoothed[points, channels]
+    half = smoothed_top / 2
+    crossings = []
+    for direction in (1, -1):
+        steps = channels[:, None] + direction * reach
+        inside = (steps >= 0) & (steps < n_channels)
+        values = smoothed[points[:, None], np.clip(steps, 0, n_channels - 1)]
+        below = inside & (values < half[:, None])
+        found = below.any(axis=1)
+        step = reach[np.argmax(below, axis=1)]
+        outer = smoothed[points, np.clip(channels + direction * step, 0, n_channels - 1)]
+        inner = smoothed[points, np.clip(channels + direction * (step - 1), 0, n_channels - 1)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.clip((inner - half) / (inner - outer), 0, 1)
+        crossing = np.interp(channels + direction * (step - 1 + fraction), np.arange(n_channels), ramanshift)
+        crossings.append(np.where(found, crossing, np.nan))
+    FWHM = crossings[0] - crossings[1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        SNR = smoothed_top / noise_std[points]
+
+    #Spikes narrower than a real peak are left out
+    wide = ~(FWHM < min_width)
+
+    return points[wide], center[wide], height[wide], FWHM[wide], SNR[wide]
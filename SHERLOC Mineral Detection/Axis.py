@@ -0,0 +1,79 @@
+import numpy as np
+
+class RamanAxis(np.ndarray):
+    def __new__(cls, ramanshift):
+        """
+        Read-only ramanshift axis shared by every spectrum of a map. Behaves like the ramanshift array it was
+        built from, and also finds the channels strictly between two ramanshift values with searchsorted. The
+        result is a slice, so indexing a spectrum with it is a view instead of a copy through a boolean mask.
+        Fixed windows, like the peak search range or the silent region, are computed once and cached.
+
+        ramanshift: x-axis of the data, the ramanshift
+        """
+        axis = np.array(ramanshift, dtype=np.float64).view(cls)
+        axis.flags.writeable = False
+
+        return axis
+
+    def __array_finalize__(self, obj):
+        # Windows keyed by (low, high)
+        self._windows = {}
+        self._ascending = None
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        # Arithmetic and comparisons on the axis give plain arrays
+        inputs = tuple(value.view(np.ndarray) if isinstance(value, RamanAxis) else value for value in inputs)
+        if "out" in kwargs:
+            kwargs["out"] = tuple(value.view(np.ndarray) if isinstance(value, RamanAxis) else value for value in kwargs["out"])
+
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getitem__(self, key):
+        # Pieces of the axis are plain arrays too
+        return self.view(np.ndarray)[key]
+
+    def __reduce__(self):
+        return (RamanAxis, (self.view(np.ndarray),))
+
+    def window(self, low, high, cache=True):
+        """
+        Finds the channels with a ramanshift strictly between low and high, the same ones as
+        (ramanshift > low) & (ramanshift < high). Returns a slice, or an array of indices if the axis is not
+        increasing.
+
+        low: lower ramanshift bound, excluded
+        high: upper ramanshift bound, excluded
+        cache: store the window for later calls, turn off for bounds that change on every call (ex: fit ranges)
+        """
+        key = (low, high)
+        if key in self._windows:
+            return self._windows[key]
+
+        values = self.view(np.ndarray)
+        if self._ascending is None:
+            self._ascending = bool(np.all(np.diff(values) > 0))
+
+        if self._ascending:
+            index = slice(int(np.searchsorted(values, low, side='right')), int(np.searchsorted(values, high, side='left')))
+        else:
+            index = np.flatnonzero((values > low) & (values < high))
+
+        if cache:
+            self._windows[key] = index
+
+        return index
+
+def window(x_data, low, high, cache=True):
+    """
+    Finds the channels of an axis with a ramanshift strictly between low and high. Returns a cached slice from
+    RamanAxis.window when x_data is a RamanAxis, otherwise the boolean mask (x_data > low) & (x_data < high).
+
+    x_data: x-axis of the data, the ramanshift, as a RamanAxis or an array
+    low: lower ramanshift bound, excluded
+    high: upper ramanshift bound, excluded
+    cache: store the window for later calls when x_data is a RamanAxis
+    """
+    if isinstance(x_data, RamanAxis):
+        return x_data.window(low, high, cache)
+
+    return (x_data > low) & (x_data < high)
@@ -0,0 +1,195 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import Cache
+import Helper
+import Pipeline
+
+def find_scans(user_path):
+    """
+    Finds every Full Map ZNZ csv file in the Data folder of a User folder. Returns a sorted list of file paths.
+
+    user_path: string with directory to the User folder
+    """
+    pattern = os.path.join(user_path, "Data", "sol_*", "*", "SrlcSpecSpec*", "ROI", "Full Map", "Full Map_spectra_ZNZ_*.csv")
+
+    return sorted(glob.glob(pattern))
+
+# Mineral pipelines of the current process, built once per worker by _init_worker
+_worker_pipeline = None
+_worker_peaks = False
+
+def _init_worker(user_path, cache_bytes, batch_fit=False, baseline_workers=1, baseline_pool="thread", peaks=False, fit_store=True, warm_start=False, prescreen=False, dtype=np.float64):
+    """
+    Builds the pipelines, one per mineral in Settings.csv, used by every scan this process runs.
+
+    user_path: string with directory to the User folder
+    cache_bytes: maximum size of the User/Cache folder, 0 disables caching
+    batch_fit: fit every point of a scan at once instead of one at a time
+    baseline_workers: number of threads or processes used to baseline the points of a scan
+    baseline_pool: "thread" or "process", the kind of pool used to baseline
+    peaks: also build the peak table of every scan
+    fit_store: save the fits of every scan to User/FitStore
+    warm_start: start the fit of each point from the fit of its closest already fitted neighbour
+    prescreen: skip fitting points that are too low near CENTER to ever be approved
+    dtype: floating point type scans are loaded and baselined in, np.float64 or np.float32
+    """
+    global _worker_pipeline, _worker_peaks
+    _worker_pipeline = Pipeline.MineralPipelines.from_user_folder(user_path, cache_bytes, batch_fit, baseline_workers, baseline_pool, fit_store, warm_start, prescreen, dtype)
+    _worker_peaks = peaks
+
+def _run_scan(file_path):
+    """
+    Runs the automatic check for every mineral on a single scan with this process's pipelines. Returns a list
+    of (approved, denied) result tables per mineral, the peak table or None, the seconds it took, and the
+    fit_stats of the scan's one at a time peakfits.
+
+    file_path: string with directory to a ZNZ csv file
+    """
+    scan_start = time.perf_counter()
+    stats_before = _worker_pipeline.fit_stats()
+    tables, peak_table = _worker_pipeline.run(file_path, _worker_peaks)
+    fit_stats = {name: count - stats_before[name] for name, count in _worker_pipeline.fit_stats().items()}
+
+    return tables, peak_table, time.perf_counter() - scan_start, fit_stats
+
+def run_batch(user_path, scans=None, workers=1, cache_bytes=1024**3, batch_fit=False, baseline_workers=1, baseline_pool="thread", peaks=False, fit_store=True, warm_start=False, prescreen=False, dtype=np.float64):
+    """
+    Runs the automatic check on a list of scans and exports each to the results folder of every mineral in
+    Settings.csv. Each scan is read and baselined once for all of the minerals. Prints the wall time of every scan
+    and a throughput summary at the end. Returns a list of (file path, spectra count, approved counts, seconds)
+    tuples, one per scan, where approved counts is a list with the number of approved points of each mineral.
+
+    Scans are processed by a pool of worker processes when workers is more than 1. Exporting always happens in
+    this process in scan order, so the result folders are the same no matter how many workers are used.
+
+    user_path: string with directory to the User folder
+    scans: list of Full Map ZNZ csv file paths, defaults to every scan in the Data folder
+    workers: number of processes to spread the scans across
+    cache_bytes: maximum size of the User/Cache folder parsed Full Map files are cached in, 0 disables it
+    batch_fit: fit every point of a scan at once with Auto.perform_peakfit_batch
+    baseline_workers: number of threads or processes used to baseline the points of each scan
+    baseline_pool: "thread" or "process", the kind of pool used to baseline
+    peaks: also write the table of every significant peak of each scan to the Peaks results folder
+    fit_store: save the fits of every scan to User/FitStore so they can be reclassified without fitting
+    warm_start: fit the points of each scan in spatial order, starting each fit from its closest fitted neighbour
+    prescreen: skip fitting points whose tallest channel near CENTER is too low to ever pass SNR_THRESHOLD
+    dtype: floating point type scans are loaded and baselined in, np.float32 halves the memory of every scan
+    """
+    if scans is None:
+        scans = find_scans(user_path)
+
+    _init_worker(user_path, cache_bytes, batch_fit, baseline_workers, baseline_pool, peaks, fit_store, warm_start, prescreen, dtype)
+
+    summary = []
+    total_stats = dict.fromkeys(_worker_pipeline.fit_stats(), 0)
+    batch_start = time.perf_counter()
+
+    executor = None
+    if workers > 1 and len(scans) > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(user_path, cache_bytes, batch_fit, baseline_workers, baseline_pool, peaks, fit_store, warm_start, prescreen, dtype))
+        scan_results = executor.map(_run_scan, scans)
+    else:
+        scan_results = map(_run_scan, scans)
+
+    try:
+        # Results come back in scan order regardless of which worker finished first
+        for file_path, (tables, peak_table, seconds, fit_stats) in zip(scans, scan_results):
+            _worker_pipeline.export(tables, file_path, user_path, peak_table)
+            for name in total_stats:
+                total_stats[name] += fit_stats[name]
+
+            spectra = len(tables[0][0]) + len(tables[0][1])
+            approved = [len(approved_results) for approved_results, denied_results in tables]
+            summary.append((file_path, spectra, approved, seconds))
+
+            counts = ", ".join(f"{pipeline.MINERAL_NAME} {count}/{spectra}" for pipeline, count in zip(_worker_pipeline.pipelines, approved))
+            peak_count = "" if peak_table is None else f", {len(peak_table)} peaks"
+            print(f"{Helper.scan_file_name(file_path)}: {counts} approved{peak_count} in {seconds:.2f} s")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    total_seconds = time.perf_counter() - batch_start
+    total_spectra = sum(scan[1] for scan in summary)
+    throughput = total_spectra / total_seconds if total_seconds > 0 else 0
+
+    print(f"Processed {len(summary)} scans ({total_spectra} spectra) in {total_seconds:.2f} s with {workers} worker(s), {throughput:.1f} spectra/second")
+    if total_stats["fits"] > 0:
+        seeded = f", {total_stats['seeded']} warm started" if warm_start else ""
+        succeeded = total_stats['fits'] - total_stats['failed']
+        print(f"Peakfits: {total_stats['fits']} fits, {total_stats['evaluations'] / max(succeeded, 1):.1f} evaluations per successful fit, {total_stats['failed']} failed{seeded}")
+    if prescreen:
+        point_fits = total_spectra * len(_worker_pipeline.pipelines)
+        print(f"Prescreen: skipped {total_stats['skipped']} of {point_fits} point fits ({100 * total_stats['skipped'] / max(point_fits, 1):.1f}%)")
+
+    return summary
+
+def reclassify(user_path):
+    """
+    Applies the current Settings.csv thresholds to every fit saved in User/FitStore and exports new result tables,
+    without baselining or fitting. Prints the approved count of every scan, the entries that were skipped and the
+    time taken. Returns the summary list from Pipeline.MineralPipelines.reclassify.
+
+    user_path: string with directory to the User folder
+    """
+    reclassify_start = time.perf_counter()
+    summary, skipped = Pipeline.MineralPipelines.from_user_folder(user_path, 0, fit_store=True).reclassify(user_path)
+
+    for mineral_name, file_path, approved, points in summary:
+        print(f"{Helper.scan_file_name(file_path)}: {mineral_name} {approved}/{points} approved")
+
+    for _, entry_path in skipped:
+        print(f"Skipping {entry_path}, it was fit with different settings, run the scan again to update it")
+
+    scans = len({file_path for _, file_path, _, _ in summary})
+    print(f"Reclassified {scans} scans ({len(summary)} scan and mineral pairs) in {time.perf_counter() - reclassify_start:.3f} s")
+
+    return summary
+
+def main(argv=None):
+    """
+    Command line entry point for running the automatic check without the GUI.
+
+    argv: list of command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Run the SHERLOC automatic check on every Full Map file in a User folder.")
+    parser.add_argument("--user", default=os.path.join(os.getcwd(), "User"), help="path to the User folder (default: ./User)")
+    parser.add_argument("--workers", type=int, default=1, help="number of scans to process in parallel (default: 1)")
+    parser.add_argument("--no-cache", action="store_true", help="always parse Full Map files instead of using User/Cache")
+    parser.add_argument("--cache-size", type=int, default=1024, help="maximum size of User/Cache in MB (default: 1024)")
+    parser.add_argument("--clear-cache", action="store_true", help="empty User/Cache before running")
+    fit_order = parser.add_mutually_exclusive_group()
+    fit_order.add_argument("--batch-fit", action="store_true", help="fit every point of a scan at once instead of one at a time")
+    parser.add_argument("--baseline-workers", type=int, default=1, help="number of threads or processes baselining each scan (default: 1)")
+    parser.add_argument("--baseline-pool", choices=["thread", "process"], default="thread", help="kind of pool used by --baseline-workers (default: thread)")
+    fit_order.add_argument("--warm-start", action="store_true", help="start each point's fit from the fit of its closest fitted neighbour in spatial.csv")
+    parser.add_argument("--prescreen", action="store_true", help="skip fitting points too low near CENTER to ever pass SNR_THRESHOLD")
+    parser.add_argument("--float32", action="store_true", help="load and baseline scans in single precision to halve their memory")
+    parser.add_argument("--peaks", action="store_true", help="also write a table of every significant peak of each scan to User/Results/Peaks")
+    parser.add_argument("--no-fit-store", action="store_true", help="do not save the fits of every scan to User/FitStore")
+    parser.add_argument("--reclassify", action="store_true", help="apply the current thresholds to the fits in User/FitStore instead of fitting")
+    args = parser.parse_args(argv)
+
+    if args.reclassify:
+        reclassify(args.user)
+        return
+
+    if args.clear_cache:
+        Cache.SpectraCache(os.path.join(args.user, "Cache")).clear()
+
+    scans = find_scans(args.user)
+    if len(scans) == 0:
+        print("No Full Map files found in " + os.path.join(args.user, "Data"))
+        return
+
+    cache_bytes = 0 if args.no_cache else args.cache_size * 1024**2
+    run_batch(args.user, scans, max(args.workers, 1), cache_bytes, args.batch_fit, max(args.baseline_workers, 1), args.baseline_pool, args.peaks, not args.no_fit_store, args.warm_start, args.prescreen, np.float32 if args.float32 else np.float64)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,571 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+import numpy as np
+from scipy.optimize import curve_fit
+
+import Auto
+import Axis
+import Helper
+import Noise
+import Pipeline
+
+def make_synthetic_map(file_path, points=100, channels=2148, seed=0):
+    """
+    Writes a synthetic Full Map ZNZ csv file with the same columns Loupe exports. Three out of four points have
+    a carbonate-like peak of varying height at 1085 cm-1 on top of a broad background and noise, and every
+    seventh point has a cosmic ray.
+
+    file_path: string with directory the csv file should be written to
+    points: number of points in the map
+    channels: number of CCD channels per spectrum
+    seed: seed for the random number generator
+    """
+    rng = np.random.default_rng(seed)
+
+    ramanshift = np.linspace(-300, 4200, channels)
+    columns = {
+        "CCD pixel": np.arange(channels),
+        "wavelength (nm)": 248.6 / (1 - 248.6e-7 * ramanshift),
+        "Raman shift (cm-1)": ramanshift
+    }
+
+    for i in range(points):
+        background = 300 * np.exp(-(ramanshift - 1500)**2 / 2e6) + 0.02 * ramanshift
+        amplitude = [0, 150, 600, 900][i % 4]
+        peak = Helper.gauss(ramanshift, amplitude, 1085 + rng.normal(0, 3), 12)
+        spectrum = background + peak + rng.normal(0, 15, channels)
+
+        # Add a two channel cosmic ray to some points
+        if i % 7 == 0:
+            ray = rng.integers(100, channels - 100)
+            spectrum[ray:ray + 2] += 2000
+
+        columns[f"Point {i}"] = spectrum
+
+    pd.DataFrame(columns).to_csv(file_path, index=False)
+
+def _best_time(func, repeats):
+    """
+    Calls a function several times. Returns the fastest wall time in seconds and the last return value.
+
+    func: function taking no arguments
+    repeats: number of times to call it
+    """
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        value = func()
+        best = min(best, time.perf_counter() - start)
+
+    return best, value
+
+def benchmark_loader(points=100, repeats=5, scan=None):
+    """
+    Compares the original list-of-lists ZNZ parsing followed by a pd.to_numeric per spectrum against
+    Helper.load_ZNZ_cube on a synthetic map.
+
+    points: number of points in the synthetic map
+    repeats: number of timed runs, the fastest is reported
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map
+    """
+    drop_list = ['CCD pixel', 'wavelength (nm)', 'Raman shift (cm-1)']
+
+    def legacy_convert(sample_df):
+        samples = np.array(sample_df.drop(drop_list, axis=1).values.T.tolist())
+        return [pd.to_numeric(sample) for sample in samples]
+
+    def cube_convert(sample_df):
+        return np.array(sample_df.drop(drop_list, axis=1).to_numpy(dtype=np.float64).T, order='C')
+
+    def legacy_load():
+        sample_df = pd.read_csv(file_path)
+        return np.array(sample_df['Raman shift (cm-1)']), legacy_convert(sample_df)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if scan is None:
+            file_path = os.path.join(directory, "Full Map_spectra_ZNZ_R1.csv")
+            make_synthetic_map(file_path, points)
+        else:
+            file_path = scan
+            points = len(Helper.load_ZNZ_cube(file_path)[1])
+
+        legacy_time, (legacy_ramanshift, legacy_samples) = _best_time(legacy_load, repeats)
+        cube_time, (ramanshift, samples) = _best_time(lambda: Helper.load_ZNZ_cube(file_path), repeats)
+        cube32_time, (_, samples32) = _best_time(lambda: Helper.load_ZNZ_cube(file_path, np.float32), repeats)
+
+        # Time the conversion after parsing on its own, csv parsing is the same cost for both
+        parsed_df = pd.read_csv(file_path)
+        legacy_convert_time, _ = _best_time(lambda: legacy_convert(parsed_df), repeats)
+        cube_convert_time, _ = _best_time(lambda: cube_convert(parsed_df), repeats)
+
+    assert np.array_equal(legacy_ramanshift, ramanshift)
+    assert np.array_equal(np.array(legacy_samples), samples)
+    assert samples.flags['C_CONTIGUOUS'] and samples.shape == (points, len(ramanshift))
+
+    print(f"ZNZ loader, {points} points x {samples.shape[1]} channels")
+    print(f"  legacy parse + to_numeric: {legacy_time * 1000:8.1f} ms")
+    print(f"  load_ZNZ_cube float64:     {cube_time * 1000:8.1f} ms  ({legacy_time / cube_time:.1f}x, {samples.nbytes / 1e6:.1f} MB)")
+    print(f"  load_ZNZ_cube float32:     {cube32_time * 1000:8.1f} ms  ({legacy_time / cube32_time:.1f}x, {samples32.nbytes / 1e6:.1f} MB)")
+    print(f"  conversion after parsing:  {legacy_convert_time * 1000:8.1f} ms -> {cube_convert_time * 1000:.1f} ms  ({legacy_convert_time / cube_convert_time:.1f}x)")
+
+def _baselined_map(points, scan=None, mhw=50, shw=5):
+    """
+    Builds a synthetic map and baselines every point like the automatic check does. Returns the ramanshift and
+    a (points, n_channels) array of baselined spectrums.
+
+    points: number of points in the synthetic map
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map
+    mhw: max half window used for the baseline
+    shw: smooth half window used for the baseline
+    """
+    if scan is not None:
+        ramanshift, spectrums = Helper.load_ZNZ_cube(scan)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "Full Map_spectra_ZNZ_R1.csv")
+            make_synthetic_map(file_path, points)
+            ramanshift, spectrums = Helper.load_ZNZ_cube(file_path)
+
+    return ramanshift, np.array([Auto.baselining(spectrum.copy(), mhw, shw)[1] for spectrum in spectrums])
+
+def _user_map(points, scan=None, user_path=None):
+    """
+    Loads the settings and noise samples of a User folder along with a map to run the automatic check on.
+    Returns the first row of Settings.csv, a Noise.NoiseLibrary, an Axis.RamanAxis of ramanshift and a
+    (points, n_channels) array of spectrums.
+
+    points: number of points in the synthetic map, at most the number of points in the noise sample
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map
+    user_path: User folder whose Settings.csv and noise samples are used, defaults to the one next to this file
+    """
+    if user_path is None:
+        user_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "User")
+
+    settings = Helper.load_settings(user_path)
+    noise_library = Noise.NoiseLibrary(os.path.join(user_path, "Noise"))
+
+    if scan is not None:
+        ramanshift, spectrums = Helper.load_ZNZ_cube(scan)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "Full Map_spectra_ZNZ_R1.csv")
+            make_synthetic_map(file_path, points)
+            ramanshift, spectrums = Helper.load_ZNZ_cube(file_path)
+
+    return settings, noise_library, Axis.RamanAxis(ramanshift), spectrums
+
+def _peak_points(r_squared, scan=None):
+    """
+    Picks the points of a map that have a real peak, the only ones where two fits can be expected to agree.
+    Returns a boolean array with one value per point.
+
+    r_squared: R squared of a reference fit of every point
+    scan: Full Map ZNZ csv file the points came from, None for the synthetic map
+    """
+    # Every fourth synthetic point is noise only, real points are judged by how well the reference fit them
+    if scan is None:
+        return np.arange(len(r_squared)) % 4 != 0
+
+    return r_squared > 0.5
+
+def benchmark_peakfit(points=100, repeats=3, scan=None):
+    """
+    Compares fitting every point of a synthetic map one at a time with Auto.perform_peakfit against fitting
+    them all at once with Auto.perform_peakfit_batch, and reports how closely the two agree.
+
+    points: number of points in the synthetic map
+    repeats: number of timed runs, the fastest is reported
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map
+    """
+    center = 1085
+    ramanshift, spectrums = _baselined_map(points, scan)
+    ramanshift = Axis.RamanAxis(ramanshift)
+    points = len(spectrums)
+
+    def loop_fit():
+        return [Auto.perform_peakfit(ramanshift, spectrum, center - 150, center + 150, center) for spectrum in spectrums]
+
+    loop_time, loop_results = _best_time(loop_fit, repeats)
+    batch_time, (params, FWHM, r_squared, cov) = _best_time(lambda: Auto.perform_peakfit_batch(ramanshift, spectrums, center - 150, center + 150, center), repeats)
+
+    # Compare the fits of points with a peak, noise-only points have no well defined minimum
+    loop_params = np.array([np.asarray(result[0], dtype=float) for result in loop_results])
+    loop_std = np.array([np.sqrt(np.abs(np.diag(result[3]))) for result in loop_results])
+    loop_r_squared = np.array([result[2] for result in loop_results])
+    peaks = _peak_points(loop_r_squared, scan)
+    params_error = np.max(np.abs(params[peaks] - loop_params[peaks]) / loop_std[peaks], initial=0)
+    r_squared_error = np.max(np.abs(r_squared[peaks] - loop_r_squared[peaks]), initial=0)
+
+    print(f"Gaussian peakfit, {points} points")
+    print(f"  perform_peakfit per point: {loop_time * 1000:8.1f} ms")
+    print(f"  perform_peakfit_batch:     {batch_time * 1000:8.1f} ms  ({loop_time / batch_time:.1f}x)")
+    print(f"  largest difference on peaks: {params_error:.2e} standard errors, {r_squared_error:.2e} R^2")
+
+def benchmark_jacobian(points=100, repeats=3, scan=None):
+    """
+    Compares curve_fit with finite difference derivatives against the analytic Helper.gauss_jacobian and
+    Helper.double_gauss_jacobian, reporting model evaluations, wall time and how closely the fits agree. The
+    double gaussian is fit around a second synthetic peak added 45 cm-1 below the main one.
+
+    points: number of points in the synthetic map
+    repeats: number of timed runs, the fastest is reported
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map
+    """
+    center = 1085
+    ramanshift, spectrums = _baselined_map(points, scan)
+    points = len(spectrums)
+
+    ind = (ramanshift > center - 150) & (ramanshift < center + 150)
+    x_fit = ramanshift[ind]
+    single_spectrums = spectrums[:, ind]
+    double_spectrums = single_spectrums + Helper.gauss(x_fit, 300, center - 45, 10)
+
+    def fit_all(model, y_data, p0, jac):
+        # Returns fit parameters, parameter standard errors and the number of model and derivative evaluations
+        params, std, evaluations = [], [], 0
+        for spectrum in y_data:
+            try:
+                fit, cov, info, _, _ = curve_fit(model, x_fit, spectrum, p0=p0(spectrum), jac=jac, full_output=True)
+                evaluations += info["nfev"] + info.get("njev", 0)
+            except RuntimeError:
+                fit, cov = np.zeros(len(p0(spectrum))), np.zeros((len(p0(spectrum)),) * 2)
+            params.append(fit)
+            std.append(np.sqrt(np.abs(np.diag(cov))))
+
+        return np.array(params), np.array(std), evaluations
+
+    fits = [
+        ("gauss", Helper.gauss, Helper.gauss_jacobian, single_spectrums,
+         lambda spectrum: [np.max(spectrum), center, 5]),
+        ("double_gauss", Helper.double_gauss, Helper.double_gauss_jacobian, double_spectrums,
+         lambda spectrum: [np.max(spectrum), center - 45, 5, np.max(spectrum), center, 5])
+    ]
+
+    # Real points are judged by how well the normal automatic check fits them
+    if scan is None:
+        base_peaks = _peak_points(np.zeros(points))
+    else:
+        base_peaks = _peak_points(np.array([Auto.perform_peakfit(ramanshift, spectrum, center - 150, center + 150, center)[2] for spectrum in spectrums]), scan)
+
+    print(f"curve_fit derivatives, {points} points")
+    for name, model, jacobian, y_data, p0 in fits:
+        numeric_time, (numeric_params, numeric_std, numeric_evaluations) = _best_time(lambda: fit_all(model, y_data, p0, None), repeats)
+        analytic_time, (analytic_params, _, analytic_evaluations) = _best_time(lambda: fit_all(model, y_data, p0, jacobian), repeats)
+
+        # Compare the fits of points with a peak, the others can settle on different fits of the noise
+        peaks = base_peaks & np.all(numeric_std > 0, axis=1)
+        error = np.max(np.abs(analytic_params[peaks] - numeric_params[peaks]) / numeric_std[peaks], initial=0)
+
+        print(f"  {name}")
+        print(f"    finite differences: {numeric_evaluations:7d} evaluations {numeric_time * 1000:8.1f} ms")
+        print(f"    analytic jacobian:  {analytic_evaluations:7d} evaluations {analytic_time * 1000:8.1f} ms  ({numeric_evaluations / max(analytic_evaluations, 1):.1f}x fewer evaluations, {numeric_time / analytic_time:.2f}x speedup)")
+        print(f"    largest difference on peaks: {error:.2e} standard errors")
+
+def benchmark_baseline(points=100, repeats=3, scan=None, mhw=50, shw=5):
+    """
+    Compares baselining a map one spectrum at a time with Auto.baselining, like scan_points does, against
+    Auto.baselining_batch on its own and with thread and process pools.
+
+    points: number of points in the synthetic map
+    repeats: number of timed runs, the fastest is reported
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map
+    mhw: max half window used for the baseline
+    shw: smooth half window used for the baseline
+    """
+    if scan is not None:
+        _, spectrums = Helper.load_ZNZ_cube(scan)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "Full Map_spectra_ZNZ_R1.csv")
+            make_synthetic_map(file_path, points)
+            _, spectrums = Helper.load_ZNZ_cube(file_path)
+
+    workers = max(os.cpu_count() or 1, 2)
+
+    def loop_baseline():
+        return np.array([Auto.baselining(spectrum.copy(), mhw, shw)[0] for spectrum in spectrums])
+
+    loop_time, loop_baselines = _best_time(loop_baseline, repeats)
+    runs = [
+        ("baselining_batch", 1, "thread"),
+        (f"  {workers} threads", workers, "thread"),
+        (f"  {workers} processes", workers, "process")
+    ]
+
+    print(f"Baseline removal, {len(spectrums)} points, max half window {mhw}, smooth half window {shw}")
+    print(f"  baselining per spectrum: {loop_time * 1000:8.1f} ms")
+    for name, run_workers, pool in runs:
+        batch_time, (baselines, _) = _best_time(lambda: Auto.baselining_batch(np.array(spectrums), mhw, shw, run_workers, pool), repeats)
+        assert np.array_equal(baselines, loop_baselines)
+        print(f"  {name + ':':24s} {batch_time * 1000:8.1f} ms  ({loop_time / batch_time:.2f}x)")
+
+def benchmark_baseline_methods(points=100, repeats=3, scan=None, user_path=None):
+    """
+    Runs the automatic check on the same map with every baseline method in Auto.BASELINE_METHODS. Reports the
+    baseline runtime per spectrum and, for the points with a peak, how many are approved and the median R^2 and
+    SNRs each method leads to downstream.
+
+    points: number of points in the synthetic map, at most the number of points in the noise sample
+    repeats: number of timed runs, the fastest is reported
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map
+    user_path: User folder whose Settings.csv and noise samples are used, defaults to the one next to this file
+    """
+    settings, noise_library, ramanshift, spectrums = _user_map(points, scan, user_path)
+
+    rows = []
+    for method in Auto.BASELINE_METHODS:
+        pipeline = Pipeline.SpectrumPipeline(dict(settings, BASELINE_METHOD=method), noise_library)
+
+        # Time the baseline stage on its own
+        stowed_arm_removed = Auto.stowed_arm_subtraction(spectrums, pipeline.noise_sample)
+        baseline_time, _ = _best_time(lambda: Auto.baselining_batch(stowed_arm_removed.copy(), pipeline.MHW, pipeline.SHW, method=method), repeats)
+
+        results = list(pipeline.process_scan(ramanshift, spectrums))
+        rows.append((method, baseline_time / len(spectrums), results))
+
+    # Judge every method on the same points, the ones swima finds a peak in for real scans
+    reference = next(results for method, _, results in rows if method == "swima")
+    peaks = _peak_points(np.array([result.r_squared for result in reference]), scan)
+
+    print(f"Baseline methods, {len(spectrums)} points, {np.sum(peaks)} with a peak, max half window {settings['SAMPLING']}, smooth half window {settings['SMOOTHING']}")
+    print(f"  {'method':10s} {'ms/spectrum':>11s} {'approved':>9s} {'median R^2':>11s} {'stowed SNR':>11s} {'silent SNR':>11s}")
+    for method, seconds, results in rows:
+        peak_results = [result for result, peak in zip(results, peaks) if peak]
+        approved = sum(result.approved for result in peak_results)
+        r_squared = np.median([result.r_squared for result in peak_results]) if peak_results else np.nan
+        SNR_stowed = np.median([result.SNR_stowed for result in peak_results]) if peak_results else np.nan
+        SNR_silent = np.median([result.SNR_silent for result in peak_results]) if peak_results else np.nan
+
+        print(f"  {method:10s} {seconds * 1000:11.2f} {approved:5d}/{len(peak_results):<3d} {r_squared:11.3f} {SNR_stowed:11.2f} {SNR_silent:11.2f}")
+
+def benchmark_warm_start(points=100, repeats=3, scan=None, user_path=None):
+    """
+    Compares fitting every point of a map from the default guess against warm started fits, where points are
+    fit in spatial order and each starts from the fit of its closest already fitted neighbour. Reports the fit
+    function evaluations, failed fits, fitting time and whether both approve the same points.
+
+    points: number of points in the synthetic map, at most the number of points in the noise sample
+    repeats: number of timed runs, the fastest is reported
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map, its spatial.csv gives the positions
+    user_path: User folder whose Settings.csv and noise samples are used, defaults to the one next to this file
+    """
+    settings, noise_library, ramanshift, spectrums = _user_map(points, scan, user_path)
+    if scan is not None:
+        positions = Helper.load_spatial(scan, len(spectrums))
+    else:
+        # Lay the synthetic points out on a square raster in scan order
+        width = int(np.ceil(np.sqrt(len(spectrums))))
+        positions = np.column_stack([np.arange(len(spectrums)) % width, np.arange(len(spectrums)) // width]).astype(float)
+
+    baselined_scan = Pipeline.SpectrumPipeline(settings, noise_library).baseline_scan(spectrums)
+
+    runs = []
+    for warm_start in [False, True]:
+        def fit_map():
+            pipeline = Pipeline.SpectrumPipeline(settings, noise_library, warm_start=warm_start)
+            return pipeline, list(pipeline.fit_scan(ramanshift, baselined_scan, positions))
+
+        fit_time, (pipeline, results) = _best_time(fit_map, repeats)
+        runs.append((fit_time, pipeline.fit_stats, np.array([result.approved for result in results])))
+
+    (cold_time, cold_stats, cold_approved), (warm_time, warm_stats, warm_approved) = runs
+    position_source = "synthetic raster" if scan is None else ("spatial.csv" if positions is not None else "scan order")
+
+    # Failed fits do not report their evaluations, so both are compared per successful fit
+    cold_evaluations = cold_stats['evaluations'] / max(cold_stats['fits'] - cold_stats['failed'], 1)
+    warm_evaluations = warm_stats['evaluations'] / max(warm_stats['fits'] - warm_stats['failed'], 1)
+
+    print(f"Warm started peakfits, {len(spectrums)} points, positions from {position_source}")
+    print(f"  default guess: {cold_evaluations:6.1f} evaluations per successful fit {cold_stats['failed']:3d} failed {cold_time * 1000:8.1f} ms")
+    print(f"  warm started:  {warm_evaluations:6.1f} evaluations per successful fit {warm_stats['failed']:3d} failed {warm_time * 1000:8.1f} ms  ({warm_stats['seeded']}/{warm_stats['fits']} seeded, {100 * (1 - warm_evaluations / max(cold_evaluations, 1e-12)):.1f}% fewer evaluations, {cold_time / warm_time:.2f}x speedup)")
+    print(f"  approvals: {np.sum(cold_approved)} default, {np.sum(warm_approved)} warm started, {np.sum(cold_approved != warm_approved)} points differ")
+
+def benchmark_initial_guess(points=100, repeats=3, scan=None):
+    """
+    Compares starting every peakfit from the fixed default guess against the closed form estimate of
+    Auto.gaussian_guess_batch, for the single gaussian and for the double gaussian around a second synthetic peak
+    added 45 cm-1 below the main one. Reports the fit function evaluations, failed fits, wall time including the
+    estimate, and how closely the fits agree on points with a peak. Also reports how far the estimate alone is
+    from the fit, for using it as a fit-free screen.
+
+    points: number of points in the synthetic map
+    repeats: number of timed runs, the fastest is reported
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map
+    """
+    center = 1085
+    other_center = center - 45
+    ramanshift, spectrums = _baselined_map(points, scan)
+    ramanshift = Axis.RamanAxis(ramanshift)
+    points = len(spectrums)
+    double_spectrums = spectrums + Helper.gauss(ramanshift, 300, other_center, 10)
+
+    def fit_single(analytic):
+        # Returns the fits, the function evaluations per successful fit and the number of failed fits
+        guesses = Auto.gaussian_guess_batch(ramanshift, spectrums, center - 150, center + 150, center)[0] if analytic else [None] * points
+        fits, evaluations, failed = [], 0, 0
+        for spectrum, p0 in zip(spectrums, guesses):
+            fit_info = {}
+            fits.append(Auto.perform_peakfit(ramanshift, spectrum, center - 150, center + 150, center, p0, fit_info))
+            evaluations += fit_info["nfev"]
+            failed += fit_info["failed"]
+
+        return fits, evaluations / max(points - failed, 1), failed
+
+    def fit_double(analytic):
+        # perform_double_peakfit does not report evaluations, so only the fits are compared
+        fits = []
+        for spectrum in double_spectrums:
+            p0 = Auto.double_gaussian_guess(ramanshift, spectrum, center - 150, center + 150, center, other_center) if analytic else None
+            fits.append(Auto.perform_double_peakfit(ramanshift, spectrum, center - 150, center + 150, center, other_center, p0))
+
+        return fits
+
+    default_time, (default_fits, default_evaluations, default_failed) = _best_time(lambda: fit_single(False), repeats)
+    analytic_time, (analytic_fits, analytic_evaluations, analytic_failed) = _best_time(lambda: fit_single(True), repeats)
+    guess_time, (guesses, usable) = _best_time(lambda: Auto.gaussian_guess_batch(ramanshift, spectrums, center - 150, center + 150, center), repeats)
+    default_double_time, default_double = _best_time(lambda: fit_double(False), repeats)
+    analytic_double_time, analytic_double = _best_time(lambda: fit_double(True), repeats)
+
+    # Compare on points with a peak, noise-only points have no well defined minimum
+    default_params = np.array([np.asarray(fit[0], dtype=float) for fit in default_fits])
+    analytic_params = np.array([np.asarray(fit[0], dtype=float) for fit in analytic_fits])
+    default_std = np.array([np.sqrt(np.abs(np.diag(fit[3]))) for fit in default_fits])
+    peaks = _peak_points(np.array([fit[2] for fit in default_fits]), scan) & np.all(default_std > 0, axis=1)
+    error = np.max(np.abs(analytic_params[peaks] - default_params[peaks]) / default_std[peaks], initial=0)
+    guess_error = np.median(np.abs(guesses[peaks] - default_params[peaks]) / np.abs(default_params[peaks]), axis=0) if np.any(peaks) else np.full(3, np.nan)
+
+    # The added peak is in every point, the focus peak is only noise in some
+    double_failed = [sum(np.all(np.asarray(fit[0]) == 0) for fit in fits) for fits in (default_double, analytic_double)]
+    double_other = np.array([[np.asarray(fit[1], dtype=float) for fit in fits] for fits in (default_double, analytic_double)])
+    both_fit = np.all(double_other[0] != 0, axis=1) & np.all(double_other[1] != 0, axis=1)
+    double_error = np.max(np.abs(double_other[1][both_fit] - double_other[0][both_fit]) / np.abs(double_other[0][both_fit]), initial=0)
+
+    print(f"Initial peakfit guess, {points} points, {np.sum(peaks)} with a peak")
+    print(f"  gauss")
+    print(f"    default guess:  {default_evaluations:6.1f} evaluations per successful fit {default_failed:3d} failed {default_time * 1000:8.1f} ms")
+    print(f"    analytic guess: {analytic_evaluations:6.1f} evaluations per successful fit {analytic_failed:3d} failed {analytic_time * 1000:8.1f} ms  ({default_evaluations / max(analytic_evaluations, 1e-12):.2f}x fewer evaluations, {default_time / analytic_time:.2f}x speedup)")
+    print(f"    largest difference on peaks: {error:.2e} standard errors")
+    print(f"  double_gauss")
+    print(f"    default guess:  {double_failed[0]:3d} failed {default_double_time * 1000:8.1f} ms")
+    print(f"    analytic guess: {double_failed[1]:3d} failed {analytic_double_time * 1000:8.1f} ms  ({default_double_time / analytic_double_time:.2f}x speedup)")
+    print(f"    largest relative difference of the added peak: {double_error:.2e}")
+    print(f"  gaussian_guess_batch alone: {guess_time * 1000:8.1f} ms, {np.sum(usable)}/{points} usable, median relative error on peaks: amplitude {guess_error[0]:.3f}, mean {guess_error[1]:.5f}, sigma {guess_error[2]:.3f}")
+
+def benchmark_prescreen(points=100, repeats=3, scan=None, user_path=None):
+    """
+    Compares fitting every point of a map against fitting only the points Pipeline.SpectrumPipeline's prescreen
+    lets through, one at a time and with batch_fit. Reports how many fits were skipped, the fitting time and
+    whether both approve the same points.
+
+    points: number of points in the synthetic map, at most the number of points in the noise sample
+    repeats: number of timed runs, the fastest is reported
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map
+    user_path: User folder whose Settings.csv and noise samples are used, defaults to the one next to this file
+    """
+    settings, noise_library, ramanshift, spectrums = _user_map(points, scan, user_path)
+
+    baselined_scan = Pipeline.SpectrumPipeline(settings, noise_library).baseline_scan(spectrums)
+
+    print(f"Prescreen, {len(spectrums)} points, SNR_THRESHOLD {settings['SNR_THRESHOLD']}, margin {Pipeline.PRESCREEN_MARGIN}")
+    for batch_fit in [False, True]:
+        runs = []
+        for prescreen in [False, True]:
+            def fit_map():
+                pipeline = Pipeline.SpectrumPipeline(settings, noise_library, batch_fit=batch_fit, prescreen=prescreen)
+                return pipeline, list(pipeline.fit_scan(ramanshift, baselined_scan))
+
+            fit_time, (pipeline, results) = _best_time(fit_map, repeats)
+            runs.append((fit_time, pipeline.fit_stats["skipped"], np.array([result.approved for result in results])))
+
+        (full_time, _, full_approved), (screened_time, skipped, screened_approved) = runs
+
+        print(f"  {'perform_peakfit_batch' if batch_fit else 'perform_peakfit per point'}")
+        print(f"    every point: {full_time * 1000:8.1f} ms")
+        print(f"    prescreened: {screened_time * 1000:8.1f} ms  ({skipped}/{len(spectrums)} skipped, {full_time / screened_time:.2f}x speedup)")
+        print(f"    approvals: {np.sum(full_approved)} every point, {np.sum(screened_approved)} prescreened, {np.sum(full_approved != screened_approved)} points differ")
+
+def benchmark_float32(points=100, repeats=3, scan=None, user_path=None):
+    """
+    Runs the automatic check on the same map in double and single precision. Reports the memory of the scan's
+    arrays, the peak memory numpy allocates while checking it, the throughput, and whether both approve the same
+    points.
+
+    points: number of points in the synthetic map, at most the number of points in the noise sample
+    repeats: number of timed runs, the fastest is reported
+    scan: optional Full Map ZNZ csv file to use instead of the synthetic map
+    user_path: User folder whose Settings.csv and noise samples are used, defaults to the one next to this file
+    """
+    settings, noise_library, ramanshift, spectrums = _user_map(points, scan, user_path)
+
+    runs = []
+    for dtype in [np.float64, np.float32]:
+        # Same spectrums load_scan returns for this dtype, Helper.load_ZNZ_cube parses in double precision and converts
+        pipeline = Pipeline.SpectrumPipeline(settings, noise_library, dtype=dtype)
+        spectrums_dtype = np.array(spectrums, dtype=dtype, order='C')
+
+        def check_scan():
+            baselined_scan = pipeline.baseline_scan(spectrums_dtype)
+            return baselined_scan, list(pipeline.fit_scan(ramanshift, baselined_scan))
+
+        check_time, (baselined_scan, results) = _best_time(check_scan, repeats)
+
+        # Peak memory is measured on its own run, tracing slows every allocation down
+        tracemalloc.start()
+        check_scan()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        array_bytes = spectrums_dtype.nbytes + sum(array.nbytes for array in baselined_scan[:3])
+        runs.append((dtype, check_time, array_bytes, peak_bytes, results))
+
+    reference = runs[0][4]
+    print(f"Single precision, {len(reference)} points")
+    for dtype, check_time, array_bytes, peak_bytes, results in runs:
+        approved = np.array([result.approved for result in results])
+        differ = np.sum(approved != np.array([result.approved for result in reference]))
+        amplitudes = np.array([result.peak_params[0] for result, reference_result in zip(results, reference) if reference_result.approved])
+        reference_amplitudes = np.array([result.peak_params[0] for result in reference if result.approved])
+        amplitude_error = np.max(np.abs(amplitudes - reference_amplitudes) / np.abs(reference_amplitudes), initial=0)
+
+        print(f"  {np.dtype(dtype).name}: {array_bytes / 1e6:6.2f} MB of arrays, {peak_bytes / 1e6:6.2f} MB peak, {check_time * 1000:8.1f} ms ({len(results) / check_time:.1f} spectra/second)")
+        print(f"    approvals: {np.sum(approved)}, {differ} points differ from float64, largest relative height difference on approved points {amplitude_error:.1e}")
+
+# Benchmarks that can be selected from the command line
+BENCHMARKS = {
+    "loader": benchmark_loader,
+    "peakfit": benchmark_peakfit,
+    "jacobian": benchmark_jacobian,
+    "initial_guess": benchmark_initial_guess,
+    "baseline": benchmark_baseline,
+    "baseline_methods": benchmark_baseline_methods,
+    "warm_start": benchmark_warm_start,
+    "prescreen": benchmark_prescreen,
+    "float32": benchmark_float32
+}
+
+def main(argv=None):
+    """
+    Command line entry point for running benchmarks.
+
+    argv: list of command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Run SHERLOC Mineral Detection performance benchmarks.")
+    parser.add_argument("names", nargs="*", help="benchmarks to run, any of " + ", ".join(BENCHMARKS) + " (default: all)")
+    parser.add_argument("--scan", help="Full Map ZNZ csv file to benchmark on instead of a synthetic map")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if len(unknown) > 0:
+        parser.error("unknown benchmark: " + ", ".join(unknown))
+
+    for name in args.names or list(BENCHMARKS):
+        BENCHMARKS[name](scan=args.scan)
+        print()
+
+if __name__ == "__main__":
+    main()
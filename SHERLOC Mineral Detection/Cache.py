@@ -0,0 +1,214 @@
+import numpy as np
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import Auto
+import Helper
+
+class SpectraCache:
+    def __init__(self, cache_path, max_bytes=1024**3):
+        """
+        Binary sidecar cache of parsed Full Map files. Each entry stores the ramanshift and spectrum arrays of one
+        file as .npy files so later loads are memory-mapped instead of parsed. Entries are keyed by the source
+        path, size, modification time and content hash, so editing a file never returns stale data. The least
+        recently used entries are evicted once the cache grows beyond max_bytes.
+
+        cache_path: string with directory to store cache entries in, created if needed
+        max_bytes: maximum total size of all entries in bytes
+        """
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+
+    def _key(self, file_path, dtype):
+        """
+        Builds the cache key of a file. Returns a hex string.
+
+        file_path: string with directory to a ZNZ csv file
+        dtype: floating point type the spectrums are stored as
+        """
+        stat = os.stat(file_path)
+
+        # Hash the file contents in chunks
+        content_hash = hashlib.sha1()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                content_hash.update(chunk)
+
+        key = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{content_hash.hexdigest()}|{np.dtype(dtype).name}"
+
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def load(self, file_path, dtype=np.float64):
+        """
+        Loads a Full Map ZNZ csv file through the cache. Returns an array of ramanshift and a (n_points, n_channels)
+        array of spectrums. Cached spectrums are read-only memory maps.
+
+        file_path: string with directory to a ZNZ csv file
+        dtype: floating point type of the returned spectrums, np.float64 or np.float32
+        """
+        entry_path = os.path.join(self.cache_path, self._key(file_path, dtype))
+
+        # Cache hit, mark the entry as recently used and map it
+        if os.path.isdir(entry_path):
+            try:
+                os.utime(entry_path)
+                ramanshift = np.load(os.path.join(entry_path, "ramanshift.npy"))
+                spectrums = np.load(os.path.join(entry_path, "spectrums.npy"), mmap_mode="r")
+                self.evict(keep=entry_path)
+                return ramanshift, spectrums
+            except (OSError, ValueError):
+                # Entry was evicted by another process or is incomplete, parse again
+                shutil.rmtree(entry_path, ignore_errors=True)
+
+        ramanshift, spectrums = Helper.load_ZNZ_cube(file_path, dtype)
+        self._store(entry_path, ramanshift, spectrums)
+        self.evict(keep=entry_path)
+
+        return ramanshift, spectrums
+
+    def _store(self, entry_path, ramanshift, spectrums):
+        """
+        Writes a new cache entry. The entry is written to a temporary folder first and renamed into place so other
+        processes never see a partial entry.
+
+        entry_path: string with directory of the entry to create
+        ramanshift: array of ramanshift
+        spectrums: (n_points, n_channels) array of spectrums
+        """
+        os.makedirs(self.cache_path, exist_ok=True)
+
+        temp_path = tempfile.mkdtemp(dir=self.cache_path, prefix=".tmp-")
+        np.save(os.path.join(temp_path, "ramanshift.npy"), ramanshift)
+        np.save(os.path.join(temp_path, "spectrums.npy"), spectrums)
+
+        try:
+            os.rename(temp_path, entry_path)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    def entries(self):
+        """
+        Lists the cache entries. Returns a list of (entry path, size in bytes, last used time) tuples, least
+        recently used first.
+        """
+        if not os.path.isdir(self.cache_path):
+            return []
+
+        entries = []
+        for name in os.listdir(self.cache_path):
+            entry_path = os.path.join(self.cache_path, name)
+            if name.startswith(".") or not os.path.isdir(entry_path):
+                continue
+
+            try:
+                size = sum(os.path.getsize(os.path.join(entry_path, file)) for file in os.listdir(entry_path))
+                entries.append((entry_path, size, os.path.getmtime(entry_path)))
+            except OSError:
+                continue
+
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        """
+        Returns the total size of every cache entry in bytes.
+        """
+        return sum(entry[1] for entry in self.entries())
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used entries until the cache fits within max_bytes.
+
+        keep: optional entry path that should never be removed (ex: the entry that was just stored)
+        """
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+
+        for entry_path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if entry_path == keep:
+                continue
+
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """
+        Removes every cache entry.
+        """
+        if os.path.isdir(self.cache_path):
+            shutil.rmtree(self.cache_path, ignore_errors=True)
+
+class BaselineCache:
+    def __init__(self, max_bytes=256 * 1024**2):
+        """
+        In-memory least recently used cache of Auto.baselining results, keyed by the spectrum contents, the
+        max and smooth half windows and the baseline method. Going back to a spectrum and settings that were
+        already tried returns the stored baseline instead of running the baseline method again. The least
+        recently used results are dropped once the stored arrays take up more than max_bytes.
+
+        max_bytes: maximum total size of the stored baselines and spectrums in bytes
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        # Lookup counts, for reporting how useful the cache is
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def size(self):
+        """
+        Returns the total size of every stored result in bytes.
+        """
+        return self._bytes
+
+    def baselining(self, y_data, mhw, shw, method="swima"):
+        """
+        Same as Auto.baselining, including zeroing the first channels of y_data in place, but returns a stored
+        result when this spectrum was already baselined with the same settings. The returned arrays are
+        read-only since they are shared between calls.
+
+        y_data: y-axis of the data, the spectrum intensity
+        mhw: max half window, half window size for removing noise in spectrum
+        shw: smooth half window, half window size for smoothing the baseline curve
+        method: name of the baseline algorithm in Auto.BASELINE_METHODS
+        """
+        # Zero the first channels before hashing so the key matches the spectrum that is actually baselined
+        y_data[:Auto.BASELINE_ZEROED_CHANNELS] = 0
+        key = (hashlib.sha1(np.ascontiguousarray(y_data).view(np.uint8)).hexdigest(), y_data.dtype.str, len(y_data), mhw, shw, str(method).lower())
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        baseline, spectrum_baseline_removed = Auto.baselining(y_data, mhw, shw, method)
+        baseline.flags.writeable = False
+        spectrum_baseline_removed.flags.writeable = False
+
+        # Store the result and drop the least recently used ones that no longer fit
+        entry = (baseline, spectrum_baseline_removed)
+        self._entries[key] = entry
+        self._bytes += baseline.nbytes + spectrum_baseline_removed.nbytes
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (old_baseline, old_spectrum) = self._entries.popitem(last=False)
+            self._bytes -= old_baseline.nbytes + old_spectrum.nbytes
+
+        return entry
+
+    def clear(self):
+        """
+        Removes every stored result.
+        """
+        self._entries.clear()
+        self._bytes = 0
@@ -0,0 +1,151 @@
+import pandas as pd
+import numpy as np
+import os
+
+# Mineral properties a catalog entry provides, these fill the same columns of a Settings.csv row when they are blank
+MINERAL_COLUMNS = ["CENTER", "CENTER_RANGE", "FWHM_MIN", "FWHM_MAX"]
+
+class MineralCatalog:
+    def __init__(self, minerals_df):
+        """
+        Catalog of minerals and the ramanshift windows their peaks fall in. Each mineral has a primary peak at
+        CENTER and optional SECONDARY_PEAKS, every peak covering CENTER +- CENTER_RANGE. The windows are indexed
+        by splitting the ramanshift axis at every window edge and storing which peaks cover each piece, so
+        finding the minerals a peak could belong to is a single binary search.
+
+        minerals_df: dataframe with a row per mineral and the columns MINERAL_NAME, CENTER, CENTER_RANGE,
+                     FWHM_MIN, FWHM_MAX and optionally SECONDARY_PEAKS (ex: "820;300")
+        """
+        self.minerals = {}
+        for _, row in minerals_df.iterrows():
+            name = str(row["MINERAL_NAME"]).strip()
+            entry = {column: float(row[column]) for column in MINERAL_COLUMNS}
+
+            # Secondary peaks are listed as semicolon separated ramanshift values
+            secondary = row.get("SECONDARY_PEAKS")
+            entry["SECONDARY_PEAKS"] = [] if pd.isna(secondary) else [float(value) for value in str(secondary).split(";") if value.strip()]
+
+            self.minerals[name] = entry
+
+        # Every peak window as (low, high, mineral name, peak center)
+        self.windows = []
+        for name, entry in self.minerals.items():
+            for center in [entry["CENTER"]] + entry["SECONDARY_PEAKS"]:
+                self.windows.append((center - entry["CENTER_RANGE"], center + entry["CENTER_RANGE"], name, center))
+
+        # Sorted window edges, piece i of the axis runs from edges[i] to edges[i + 1]
+        self.edges = np.unique([edge for window in self.windows for edge in window[:2]])
+
+        # Indices of the windows covering each piece, windows include both of their edges
+        self.covering = [[] for _ in range(max(len(self.edges) - 1, 0))]
+        for index, (low, high, _, _) in enumerate(self.windows):
+            first = int(np.searchsorted(self.edges, low))
+            last = int(np.searchsorted(self.edges, high))
+            for piece in range(first, last):
+                self.covering[piece].append(index)
+
+    @classmethod
+    def from_user_folder(cls, user_path):
+        """
+        Loads the Minerals.csv file in the given user folder. Returns a MineralCatalog, or None if the folder has
+        no catalog.
+
+        user_path: string with directory to the User folder
+        """
+        catalog_path = os.path.join(user_path, "Minerals.csv")
+        if not os.path.isfile(catalog_path):
+            return None
+
+        return cls(pd.read_csv(catalog_path))
+
+    def __len__(self):
+        return len(self.minerals)
+
+    def __contains__(self, name):
+        return str(name).strip() in self.minerals
+
+    def names(self):
+        """
+        Returns a list of the mineral names in catalog order.
+        """
+        return list(self.minerals)
+
+    def mineral(self, name):
+        """
+        Returns the catalog entry of a mineral as a dictionary of its properties.
+
+        name: name of the mineral (ex: Carbonate)
+        """
+        return self.minerals[str(name).strip()]
+
+    def settings_for(self, settings):
+        """
+        Fills in a Settings.csv row from the catalog entry of its MINERAL_NAME. Returns a new settings dictionary
+        with the catalog's CENTER, CENTER_RANGE and FWHM bounds in place of the ones that are missing or blank,
+        values given in Settings.csv are kept. The settings are returned unchanged if the mineral is not in the
+        catalog.
+
+        settings: dictionary of user settings as returned by Helper.load_settings
+        """
+        if settings["MINERAL_NAME"] not in self:
+            return settings
+
+        entry = self.mineral(settings["MINERAL_NAME"])
+        settings = dict(settings)
+        for column in MINERAL_COLUMNS:
+            if column in settings and not pd.isna(settings[column]):
+                continue
+
+            # Keep whole numbers as integers like they are read from Settings.csv
+            settings[column] = int(entry[column]) if entry[column].is_integer() else entry[column]
+
+        return settings
+
+    def _candidates(self, center):
+        """
+        Returns the indices of the windows that contain a ramanshift value.
+
+        center: ramanshift value to look up
+        """
+        piece = int(np.searchsorted(self.edges, center, side='right')) - 1
+        if piece < 0 or len(self.covering) == 0:
+            return []
+
+        # A value on the last edge or between two pieces is also covered by windows ending there
+        candidates = list(self.covering[piece]) if piece < len(self.covering) else []
+        if piece > 0 and center == self.edges[piece]:
+            candidates += self.covering[piece - 1]
+
+        return [index for index in set(candidates) if self.windows[index][0] <= center <= self.windows[index][1]]
+
+    def lookup(self, center, FWHM=None):
+        """
+        Finds the minerals a peak could belong to. Returns a list of (mineral name, catalogued peak center)
+        tuples, closest catalogued peak first.
+
+        center: ramanshift of the peak center
+        FWHM: optional full width half max of the peak, minerals whose FWHM bounds exclude it are skipped
+        """
+        matches = []
+        for index in self._candidates(center):
+            _, _, name, peak_center = self.windows[index]
+            entry = self.minerals[name]
+            if FWHM is not None and not entry["FWHM_MIN"] <= FWHM <= entry["FWHM_MAX"]:
+                continue
+
+            matches.append((name, peak_center))
+
+        return sorted(matches, key=lambda match: (abs(match[1] - center), match[0]))
+
+    def lookup_many(self, centers, FWHMs=None):
+        """
+        Finds the minerals each of several peaks could belong to. Returns a list with the lookup result of every
+        peak, in the same order.
+
+        centers: array of peak center ramanshifts
+        FWHMs: optional array of peak full width half maxes
+        """
+        if FWHMs is None:
+            return [self.lookup(center) for center in centers]
+
+        return [self.lookup(center, FWHM) for center, FWHM in zip(centers, FWHMs)]
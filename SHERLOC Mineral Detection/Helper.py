@@ -1,5 +1,6 @@
 import pandas as pd
 import numpy as np
+import os
 
 def gauss(x, A, mu, sigma):
     """
@@ -26,24 +27,211 @@ def double_gauss(x, A1, mu1, sigma1, A2, mu2, sigma2):
     """
     return gauss(x, A1, mu1, sigma1) + gauss(x, A2, mu2, sigma2)
 
+def gauss_jacobian(x, A, mu, sigma):
+    """
+    Evaluates the partial derivatives of a gaussian distribution with respect to its parameters. Returns an array
+    with a last axis of (d/dA, d/dmu, d/dsigma), usable as the jac of curve_fit.
+
+    x: x-axis value you want the derivatives evaluated at
+    A: amplitude
+    mu: mean/center of the distribution
+    sigma: standard deviation
+    """
+    offset = x - mu
+    exponential = np.exp(-offset**2 / (2. * sigma**2))
+    d_mu = A * exponential * offset / sigma**2
+    d_sigma = A * exponential * offset**2 / sigma**3
+
+    return np.stack([exponential, d_mu, d_sigma], axis=-1)
+
+def double_gauss_jacobian(x, A1, mu1, sigma1, A2, mu2, sigma2):
+    """
+    Evaluates the partial derivatives of a double gaussian distribution with respect to its parameters. Returns
+    an array with a last axis of (d/dA1, d/dmu1, d/dsigma1, d/dA2, d/dmu2, d/dsigma2), usable as the jac of
+    curve_fit.
+
+    x: x-axis value you want the derivatives evaluated at
+    A1: amplitude of the first gaussian
+    mu1: mean/center of the first distribution
+    sigma1: standard deviation of the first gaussian
+    A2: amplitude of the second gaussian
+    mu2: mean/center of the second distribution
+    sigma2: standard deviation second
+    """
+    return np.concatenate([gauss_jacobian(x, A1, mu1, sigma1), gauss_jacobian(x, A2, mu2, sigma2)], axis=-1)
+
+def load_ZNZ_cube(file_path, dtype=np.float64):
+    """
+    Takes in a file path to a Full Map ZNZ csv file. Returns an array of ramanshift and a C-contiguous
+    (n_points, n_channels) array of spectrums, parsed in a single pass. Assumes the file path does exist.
+
+    file_path: string with directory to a ZNZ csv file
+    dtype: floating point type of the returned spectrums, np.float64 or np.float32
+    """
+    # Parse only the ramanshift and point columns, all straight to floats
+    sample_df = pd.read_csv(file_path, usecols=lambda column: column not in ['CCD pixel', 'wavelength (nm)'], dtype=np.float64)
+
+    # Store ramanshift for x-axis usage, same for all data sets
+    ramanshift = sample_df.pop('Raman shift (cm-1)').to_numpy()
+
+    # Columns are points, transpose so each row is a spectrum
+    samples = np.array(sample_df.to_numpy().T, dtype=dtype, order='C')
+
+    return ramanshift, samples
+
 def process_ZNZ_dataframe(file_path):
     """
     Takes in a file path to a Full Map ZNZ csv file. Returns an array of ramanshift 
-    and a dataframe of spectrums for that file. Assumes the file path does exist.
+    and an array of spectrums for that file. Assumes the file path does exist.
 
     file_path: string with directory to a ZNZ csv file
     """
-    sample_df = pd.read_csv(file_path)
+    return load_ZNZ_cube(file_path)
 
-    # First columns we can drop to only access data
-    drop_list = ['CCD pixel','wavelength (nm)','Raman shift (cm-1)']
+def load_settings(user_path):
+    """
+    Reads the Settings.csv file in the given user folder. Returns a dictionary of the setting values keyed by
+    their column name.
 
-    # Store ramanshift for x-axis usage, same for all data sets
-    ramanshift = np.array(sample_df['Raman shift (cm-1)'])
+    user_path: string with directory to the User folder
+    """
+    return load_all_settings(user_path)[0]
+
+def load_all_settings(user_path):
+    """
+    Reads every row of the Settings.csv file in the given user folder, one row per mineral to search for. Returns
+    a list of dictionaries of the setting values keyed by their column name, in row order.
+
+    user_path: string with directory to the User folder
+    """
+    settings_df = pd.read_csv(os.path.join(user_path, "Settings.csv"))
+
+    return [{column: settings_df[column][row] for column in settings_df.columns} for row in range(len(settings_df))]
 
-    # Prepare sample dataframe for use
-    sample_df.drop(drop_list, axis=1, inplace=True)
+def scan_file_name(file_path):
+    """
+    Builds the name used for result files of a scan from its Full Map file path (ex: sol_0489-detail_1).
+
+    file_path: string with directory to a Full Map ZNZ csv file inside the User/Data folder
+    """
+    # Split the full map directory to access naming information
+    split_path = os.path.normpath(file_path).split(os.sep)
+
+    # Store the scan name and scan type
+    scan_name = split_path[-6]
+    scan_type = split_path[-5]
+
+    return scan_name + '-' + scan_type
+
+def scan_entry_name(file_path):
+    """
+    Builds a name for a scan that is unique within the User/Data folder, for files that are replaced each time the
+    scan is run (ex: sol_0489-detail_1-SrlcSpecSpec_0001-R1). Unlike scan_file_name, Full Map files in the same
+    scan folder get different names.
+
+    file_path: string with directory to a Full Map ZNZ csv file inside the User/Data folder
+    """
+    # The SrlcSpecSpec folder is three folders above the Full Map file
+    split_path = os.path.normpath(file_path).split(os.sep)
+    stem = os.path.splitext(split_path[-1])[0]
+
+    # Keep only what follows the Full Map prefix (ex: R1), other file names are kept whole
+    prefix = 'Full Map_spectra_ZNZ_'
+    if stem.startswith(prefix):
+        stem = stem[len(prefix):]
+
+    return scan_file_name(file_path) + '-' + split_path[-4] + '-' + stem
+
+def load_spatial(file_path, n_points):
+    """
+    Reads the positions of the points of a scan from the spatial.csv file Loupe exports next to its ROI folder.
+    Returns a (n_points, 2) array of az and el values, or None if the file is missing or has too few rows.
+
+    file_path: string with directory to a Full Map ZNZ csv file inside the User/Data folder
+    n_points: number of points in the scan
+    """
+    # The spatial file is in the SrlcSpecSpec folder, three folders above the Full Map file
+    scan_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(file_path))))
+    spatial_path = os.path.join(scan_path, 'spatial.csv')
+    if not os.path.isfile(spatial_path):
+        return None
+
+    # The last rows of the spatial dataframe hold the position of each point
+    spatial_df = pd.read_csv(spatial_path)
+    if len(spatial_df) < n_points or "az" not in spatial_df or "el" not in spatial_df:
+        return None
+
+    return spatial_df[["az", "el"]].iloc[len(spatial_df) - n_points:].to_numpy(dtype=np.float64)
+
+def export_results(approved_df, denied_df, file_path, mineral_name, user_path):
+    """
+    Exports approved and denied result dataframes to a new folder in the results folder. Returns the path of the
+    folder that was created.
+
+    approved_df: dataframe of approved points
+    denied_df: dataframe of denied points
+    file_path: string with directory to the Full Map ZNZ csv file the results came from
+    mineral_name: name of the mineral, used as the results subfolder
+    user_path: string with directory to the User folder
+    """
+    # Build a file name from the scan name and type
+    file_name = scan_file_name(file_path)
+
+    # Create a result directory if needed
+    result_directory = os.path.join(user_path, "Results", mineral_name)
+    os.makedirs(result_directory, exist_ok=True)
+
+    # Increment the folder counter until we create a unique folder name, creating it in the same step so another
+    # process exporting the same scan can never claim the same folder
+    folder_count = 1
+    while True:
+        folder_path = os.path.join(result_directory, file_name + '_' + str(folder_count))
+        try:
+            os.makedirs(folder_path)
+            break
+        except FileExistsError:
+            folder_count += 1
+
+    # Initialize our file paths and store results
+    approved_file = os.path.join(folder_path, file_name + '_Approved.csv')
+    denied_file = os.path.join(folder_path, file_name + '_Denied.csv')
+    approved_df.to_csv(approved_file, index=False)
+    denied_df.to_csv(denied_file, index=False)
+
+    return folder_path
+
+def export_peaks(peak_df, file_path, user_path):
+    """
+    Exports the peak table of a scan to the Peaks folder in the results folder, replacing an earlier table of the
+    same scan. Returns the path of the file that was written.
+
+    peak_df: dataframe of the peaks found in the scan
+    file_path: string with directory to the Full Map ZNZ csv file the peaks came from
+    user_path: string with directory to the User folder
+    """
+    # Create a peaks directory if needed
+    peak_directory = os.path.join(user_path, "Results", "Peaks")
+    os.makedirs(peak_directory, exist_ok=True)
+
+    peak_file = os.path.join(peak_directory, scan_entry_name(file_path) + '_Peaks.csv')
+    peak_df.to_csv(peak_file, index=False)
+
+    return peak_file
+
+def export_sweep(sweep_df, mineral_name, user_path):
+    """
+    Exports the table of a sampling and smoothing sweep to the Sweep folder in the results folder, replacing an
+    earlier sweep of the same mineral. Returns the path of the file that was written.
+
+    sweep_df: dataframe with a row per sampling and smoothing pair
+    mineral_name: name of the mineral the sweep was run for
+    user_path: string with directory to the User folder
+    """
+    # Create a sweep directory if needed
+    sweep_directory = os.path.join(user_path, "Results", "Sweep")
+    os.makedirs(sweep_directory, exist_ok=True)
 
-    samples = np.array(sample_df.values.T.tolist())
+    sweep_file = os.path.join(sweep_directory, mineral_name + '_Sweep.csv')
+    sweep_df.to_csv(sweep_file, index=False)
 
-    return ramanshift, samples
\ No newline at end of file
+    return sweep_file
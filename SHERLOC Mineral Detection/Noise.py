@@ -0,0 +1,85 @@
+import pandas as pd
+import numpy as np
+import os
+
+import Auto
+
+class NoiseLibrary:
+    def __init__(self, noise_path):
+        """
+        Loads every stowed arm noise scan in a folder once. Each scan is stored as a (n_points, n_channels) array
+        with its median spectrum precomputed, and the standard deviation of every point around a peak center is
+        computed once per center and reused.
+
+        noise_path: string with directory to the Noise folder
+        """
+        self.samples = {}
+        self.medians = {}
+        self.point_rows = {}
+
+        # Cached stowed arm standard deviations keyed by (sample name, center)
+        self._stowed_std = {}
+
+        for file_name in sorted(os.listdir(noise_path)):
+            if not file_name.lower().endswith(".csv"):
+                continue
+
+            noise_df = pd.read_csv(os.path.join(noise_path, file_name), dtype=np.float64)
+            name = os.path.splitext(file_name)[0]
+
+            # Columns are points, transpose so each row is a noise spectrum
+            self.samples[name] = np.array(noise_df.to_numpy().T, order='C')
+            self.point_rows[name] = {int(column.rsplit(' ', 1)[1]): row for row, column in enumerate(noise_df.columns)}
+            self.medians[name] = np.nanmedian(self.samples[name], axis=0)
+
+    def names(self):
+        """
+        Returns a sorted list of the available noise sample names.
+        """
+        return sorted(self.samples)
+
+    def median(self, name):
+        """
+        Returns the median noise spectrum of a sample, used for stowed arm subtraction.
+
+        name: name of the noise sample (ex: Noise678_Rays_Removed)
+        """
+        return self.medians[name]
+
+    def point(self, name, point_index):
+        """
+        Returns the noise spectrum of a single point of a sample.
+
+        name: name of the noise sample (ex: Noise678_Rays_Removed)
+        point_index: index of the point within the noise scan
+        """
+        return self.samples[name][self.point_rows[name][point_index]]
+
+    def stowed_std(self, name, ramanshift, center):
+        """
+        Returns the standard deviation of every point of a sample in the stowed arm SNR window around a center,
+        in the same order as the rows of the sample. Computed once per sample and center.
+
+        name: name of the noise sample (ex: Noise678_Rays_Removed)
+        ramanshift: x-axis of the data, the ramanshift
+        center: location of the peak center
+        """
+        key = (name, center)
+        cached = self._stowed_std.get(key)
+        if cached is None or not (cached[0] is ramanshift or np.array_equal(cached[0], ramanshift)):
+            std = Auto.calculate_noise_stowed_arm(ramanshift, self.samples[name], center)
+            cached = (ramanshift, std)
+            self._stowed_std[key] = cached
+
+        return cached[1]
+
+    def point_stowed_std(self, name, point_index, ramanshift, center):
+        """
+        Returns the standard deviation of a single point of a sample in the stowed arm SNR window around a center.
+
+        name: name of the noise sample (ex: Noise678_Rays_Removed)
+        point_index: index of the point within the noise scan
+        ramanshift: x-axis of the data, the ramanshift
+        center: location of the peak center
+        """
+        return self.stowed_std(name, ramanshift, center)[self.point_rows[name][point_index]]
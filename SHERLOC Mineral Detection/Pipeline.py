@@ -0,0 +1,883 @@
+import pandas as pd
+import numpy as np
+import copy
+import os
+
+import Auto
+import Axis
+import Cache
+import Catalog
+import Helper
+import Noise
+import Store
+
+# Columns of the approved and denied result dataframes
+RESULT_COLUMNS = ["Point", "Height", "Height STD", "Mean", "Mean STD", "Sigma", "Sigma STD", "FWHM", "R^2", "Stowed SNR", "Silent SNR"]
+
+# Starting guesses the PEAK_GUESS setting can pick for the peakfits
+PEAK_GUESSES = ["default", "analytic"]
+
+# Fraction of the height an approved peak needs that the tallest channel near CENTER must reach to be fit with
+# prescreen on. Approved peaks on the sample scans all reach more than the full height, this leaves room for noise
+PRESCREEN_MARGIN = 0.5
+
+# Smoothed SNR a peak needs to be listed in the peak table, unless SNR_THRESHOLD is higher. Every point has about a
+# hundred places a noise peak could show up, on the sample scans this keeps the peaks at CENTER and few others
+PEAK_SNR_THRESHOLD = 6
+
+# Columns of the peak table of a scan, a Minerals column is added when a catalog is available
+PEAK_COLUMNS = ["Point", "Center", "Height", "FWHM", "SNR"]
+
+class ResultTable:
+    def __init__(self, capacity=100):
+        """
+        Accumulates result rows in a preallocated array with the RESULT_COLUMNS columns. The array doubles in size
+        when it fills up, so appending is amortized constant time. Rows are only turned into a dataframe once, by
+        to_dataframe.
+
+        capacity: number of rows to allocate up front, usually the number of points in the scan
+        """
+        self._values = np.empty((max(capacity, 1), len(RESULT_COLUMNS)))
+        self._count = 0
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Builds a table holding the rows of a (rows, columns) array with the RESULT_COLUMNS columns.
+
+        values: (rows, columns) array of result rows
+        """
+        table = cls(len(values))
+        table._values[:len(values)] = values
+        table._count = len(values)
+
+        return table
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row):
+        """
+        Adds a row to the end of the table.
+
+        row: dictionary keyed by RESULT_COLUMNS, as returned by SpectrumPipeline.result_row
+        """
+        # Grow the array if it is full
+        if self._count == len(self._values):
+            self._values = np.concatenate([self._values, np.empty_like(self._values)])
+
+        self._values[self._count] = [row[column] for column in RESULT_COLUMNS]
+        self._count += 1
+
+    def values(self):
+        """
+        Returns a (rows, columns) array view of the rows added so far.
+        """
+        return self._values[:self._count]
+
+    def to_dataframe(self):
+        """
+        Returns the rows added so far as a dataframe with the RESULT_COLUMNS columns.
+        """
+        return pd.DataFrame(self.values().copy(), columns=RESULT_COLUMNS)
+
+class PointResult:
+    def __init__(self, point_index, spectrum_stowed_arm_removed, noise, sampling, smoothing):
+        """
+        Stores everything the pipeline produced for a single point of a scan.
+
+        point_index: index of the point within the scan
+        spectrum_stowed_arm_removed: spectrum intensity with the median stowed arm sample removed
+        noise: stowed arm noise for this point
+        sampling: max half window used for the baseline
+        smoothing: smooth half window used for the baseline
+        """
+        self.point_index = point_index
+        self.spectrum_stowed_arm_removed = spectrum_stowed_arm_removed
+        self.noise = noise
+        self.sampling = sampling
+        self.smoothing = smoothing
+
+        # Filled in by SpectrumPipeline.fit_point
+        self.baseline = None
+        self.spectrum = None
+        self.peak_params = None
+        self.FWHM = None
+        self.r_squared = None
+        self.cov = None
+
+        # Standard deviations the SNRs are calculated from, only change when the spectrum does
+        self.noise_stowed_std = None
+        self.noise_silent_std = None
+
+        self.SNR_stowed = None
+        self.SNR_silent = None
+        self.approved = False
+
+class SpectrumPipeline:
+    def __init__(self, settings, noise_library, cache=None, batch_fit=False, baseline_workers=1, baseline_pool="thread", baseline_cache=None, catalog=None, warm_start=False, prescreen=False, dtype=np.float64):
+        """
+        Headless version of the automatic check. Runs stowed arm subtraction, baselining, peakfitting, SNR
+        and approval on the spectra of a Full Map file without any tkinter dependency.
+
+        settings: dictionary of user settings as returned by Helper.load_settings
+        noise_library: Noise.NoiseLibrary containing the NOISE_SAMPLE selected in the settings
+        cache: optional Cache.SpectraCache to load Full Map files through
+        batch_fit: fit every point of a scan at once with Auto.perform_peakfit_batch instead of one at a time
+        baseline_workers: number of threads or processes used to baseline the points of a scan
+        baseline_pool: "thread" or "process", the kind of pool used when baseline_workers is more than 1
+        baseline_cache: optional Cache.BaselineCache that fit_point baselines through
+        catalog: optional Catalog.MineralCatalog to identify other peaks with, settings should already be filled in
+                 from it with MineralCatalog.settings_for
+        warm_start: fit the points of a scan in spatial order, starting each fit from the fit of the closest point
+                    already fitted instead of the default guess, ignored when batch_fit is set
+        prescreen: skip the peakfit of points whose tallest channel near CENTER is too low to ever pass
+                   SNR_THRESHOLD, they are recorded as failed fits
+        dtype: floating point type scans are loaded, cleaned and baselined in, np.float64 or np.float32, which
+               halves the memory of each scan. Peakfits always run in np.float64
+        """
+        # Parameter constants
+        self.SNR_THRESHOLD = settings["SNR_THRESHOLD"]
+        self.R_SQUARED_THRESHOLD = settings["R_SQUARED_THRESHOLD"]
+        self.FWHM_MIN = settings["FWHM_MIN"]
+        self.FWHM_MAX = settings["FWHM_MAX"]
+        self.CENTER_RANGE = settings["CENTER_RANGE"]
+        self.MHW = settings["SAMPLING"]
+        self.SHW = settings["SMOOTHING"]
+        self.MINERAL_NAME = settings["MINERAL_NAME"]
+        self.CENTER = settings["CENTER"]
+        self.NOISE_SAMPLE = settings["NOISE_SAMPLE"]
+
+        # Older Settings.csv files have no BASELINE_METHOD column, they always used swima
+        method = settings.get("BASELINE_METHOD")
+        self.BASELINE_METHOD = "swima" if pd.isna(method) else str(method).strip().lower()
+        Auto.baseline_method(self.BASELINE_METHOD)
+
+        # Automatic cosmic ray removal is off unless a COSMIC_RAY_THRESHOLD above 0 is set
+        threshold = settings.get("COSMIC_RAY_THRESHOLD")
+        self.COSMIC_RAY_THRESHOLD = 0 if pd.isna(threshold) else float(threshold)
+
+        # Peakfits start from the fixed default guess unless PEAK_GUESS is "analytic"
+        guess = settings.get("PEAK_GUESS")
+        self.PEAK_GUESS = "default" if pd.isna(guess) else str(guess).strip().lower()
+        if self.PEAK_GUESS not in PEAK_GUESSES:
+            raise ValueError(f"Unknown peak guess '{guess}', expected one of: " + ", ".join(PEAK_GUESSES))
+
+        # Range to search for a peak within
+        self.ind1 = self.CENTER - 150
+        self.ind2 = self.CENTER + 150
+
+        # Store the noise and a median noise sample for subtraction, in the type scans are processed in
+        self.dtype = np.dtype(dtype)
+        self.noise_library = noise_library
+        self.noise_sample = np.asarray(self.noise_library.median(self.NOISE_SAMPLE), dtype=self.dtype)
+
+        self.cache = cache
+        self.batch_fit = batch_fit
+        self.baseline_workers = baseline_workers
+        self.baseline_pool = baseline_pool
+        self.baseline_cache = baseline_cache
+        self.catalog = catalog
+        self.warm_start = warm_start
+        self.prescreen = prescreen
+
+        # Running totals of the one at a time peakfits, evaluations counts the fit function evaluations of the fits
+        # that did not fail, skipped counts the points of any fit mode left out by the prescreen
+        self.fit_stats = {"fits" : 0, "evaluations" : 0, "failed" : 0, "seeded" : 0, "skipped" : 0}
+
+    @classmethod
+    def from_user_folder(cls, user_path, cache_bytes=1024**3, batch_fit=False, baseline_workers=1, baseline_pool="thread", baseline_cache_bytes=0, warm_start=False, prescreen=False, dtype=np.float64):
+        """
+        Builds a pipeline from the Settings.csv and selected noise sample of a User folder. If the folder has a
+        Minerals.csv catalog with the selected MINERAL_NAME, its peak window and FWHM bounds fill in the ones left
+        blank in Settings.csv.
+
+        user_path: string with directory to the User folder
+        cache_bytes: maximum size of the User/Cache folder parsed Full Map files are cached in, 0 disables it
+        batch_fit: fit every point of a scan at once with Auto.perform_peakfit_batch
+        baseline_workers: number of threads or processes used to baseline the points of a scan
+        baseline_pool: "thread" or "process", the kind of pool used when baseline_workers is more than 1
+        baseline_cache_bytes: maximum size of the in-memory cache of baselines tried on single points, 0 disables it
+        warm_start: fit the points of a scan in spatial order, each starting from its closest fitted neighbour
+        prescreen: skip the peakfit of points too low near CENTER to ever pass SNR_THRESHOLD
+        dtype: floating point type scans are loaded, cleaned and baselined in, np.float64 or np.float32
+        """
+        catalog = Catalog.MineralCatalog.from_user_folder(user_path)
+        settings = Helper.load_settings(user_path)
+        if catalog is not None:
+            settings = catalog.settings_for(settings)
+
+        noise_library = Noise.NoiseLibrary(os.path.join(user_path, "Noise"))
+        cache = Cache.SpectraCache(os.path.join(user_path, "Cache"), cache_bytes) if cache_bytes > 0 else None
+        baseline_cache = Cache.BaselineCache(baseline_cache_bytes) if baseline_cache_bytes > 0 else None
+
+        return cls(settings, noise_library, cache, batch_fit, baseline_workers, baseline_pool, baseline_cache, catalog, warm_start, prescreen, dtype)
+
+    def with_sampling(self, mhw, shw):
+        """
+        Returns a copy of this pipeline that baselines with a different sampling and smoothing. The copy shares
+        the noise library, caches and catalog of this pipeline.
+
+        mhw: max half window, the SAMPLING setting to use
+        shw: smooth half window, the SMOOTHING setting to use
+        """
+        pipeline = copy.copy(self)
+        pipeline.MHW = mhw
+        pipeline.SHW = shw
+
+        return pipeline
+
+    def load_scan(self, file_path):
+        """
+        Loads a Full Map ZNZ csv file. Returns an Axis.RamanAxis of ramanshift and a (n_points, n_channels) array
+        of spectrums with the pipeline's dtype.
+
+        file_path: string with directory to a ZNZ csv file
+        """
+        if self.cache is not None:
+            ramanshift, spectrums = self.cache.load(file_path, self.dtype)
+        else:
+            ramanshift, spectrums = Helper.load_ZNZ_cube(file_path, self.dtype)
+
+        return Axis.RamanAxis(ramanshift), spectrums
+
+    def load_positions(self, file_path, n_points):
+        """
+        Loads the point positions of a scan used to find the spatial neighbours of each point for cosmic ray
+        detection and warm started fits. Returns a (n_points, 2) array from Helper.load_spatial, or None if both
+        cosmic ray removal and warm_start are off or the scan has no spatial.csv.
+
+        file_path: string with directory to a ZNZ csv file
+        n_points: number of points in the scan
+        """
+        if self.COSMIC_RAY_THRESHOLD <= 0 and not self.warm_start:
+            return None
+
+        return Helper.load_spatial(file_path, n_points)
+
+    def detect_rays(self, spectrums, positions=None):
+        """
+        Finds the cosmic rays of every raw spectrum of a scan at once with Auto.detect_cosmic_rays. Returns a
+        boolean (n_points, n_channels) ray mask, or None if cosmic ray removal is off.
+
+        spectrums: (n_points, n_channels) array of raw spectrum intensities
+        positions: optional (n_points, 2) array of point positions from load_positions, the scan order is used
+                   to find neighbours without it
+        """
+        if self.COSMIC_RAY_THRESHOLD <= 0 or len(spectrums) == 0:
+            return None
+
+        spectrums_stowed_arm_removed = Auto.stowed_arm_subtraction(np.asarray(spectrums, dtype=self.dtype), self.noise_sample)
+        neighbours = Auto.spatial_neighbours(len(spectrums), positions)
+
+        return Auto.detect_cosmic_rays(spectrums_stowed_arm_removed, neighbours, self.COSMIC_RAY_THRESHOLD)
+
+    def prepare_point(self, point_index, spectrum_raw, ray_mask=None):
+        """
+        Removes the stowed arm median, and the cosmic rays if a ray mask is given, from a raw spectrum. Returns a
+        PointResult that has not been fit yet.
+
+        point_index: index of the point within the scan
+        spectrum_raw: raw spectrum intensity of the point
+        ray_mask: optional boolean array flagging the cosmic ray channels of the spectrum
+        """
+        # Store current noise
+        noise = self.noise_library.point(self.NOISE_SAMPLE, point_index)
+
+        # Remove stowed arm noise median
+        spectrum_stowed_arm_removed = Auto.stowed_arm_subtraction(spectrum_raw, self.noise_sample)
+
+        # Replace any detected cosmic rays
+        if ray_mask is not None:
+            _, lower, upper = Auto.ray_intervals(np.asarray(ray_mask)[None, :])
+            Auto.replace_cosmic_rays(spectrum_stowed_arm_removed, lower, upper)
+
+        return PointResult(point_index, spectrum_stowed_arm_removed, noise, self.MHW, self.SHW)
+
+    def fit_point(self, ramanshift, result):
+        """
+        Baselines, peakfits and calculates the SNR of a prepared point using its current sampling and smoothing.
+        Updates and returns the given PointResult.
+
+        ramanshift: x-axis of the data, the ramanshift
+        result: PointResult from prepare_point, spectrum_stowed_arm_removed may have been edited since
+        """
+        # Calculate and remove a baseline, reusing an earlier one if this spectrum and settings were tried before
+        baselining = Auto.baselining if self.baseline_cache is None else self.baseline_cache.baselining
+        result.baseline, result.spectrum = baselining(result.spectrum_stowed_arm_removed, result.sampling, result.smoothing, self.BASELINE_METHOD)
+
+        # Fit a gaussian curve to the data at our desired location
+        p0 = Auto.gaussian_guess(ramanshift, result.spectrum, self.ind1, self.ind2, self.CENTER) if self.PEAK_GUESS == "analytic" else None
+        result.peak_params, result.FWHM, result.r_squared, result.cov = Auto.perform_peakfit(ramanshift, result.spectrum, self.ind1, self.ind2, self.CENTER, p0)
+
+        # Store the noise levels of the new spectrum
+        result.noise_stowed_std = self.noise_library.point_stowed_std(self.NOISE_SAMPLE, result.point_index, ramanshift, self.CENTER)
+        result.noise_silent_std = Auto.calculate_noise_silent_region(ramanshift, result.spectrum)
+
+        return self.score_point(result)
+
+    def calculate_SNR(self, result, amplitude):
+        """
+        Calculates the stowed arm and silent region SNR of a peak from the noise levels stored on a fitted point,
+        without looking at the spectrum again. Returns a (stowed SNR, silent SNR) tuple.
+
+        result: PointResult whose noise levels were filled in by fit_point or process_scan
+        amplitude: amplitude of the fitted peak
+        """
+        return amplitude / result.noise_stowed_std, amplitude / result.noise_silent_std
+
+    def score_point(self, result):
+        """
+        Calculates the SNR of a baselined and peakfit point and applies the user thresholds. Updates and returns
+        the given PointResult.
+
+        result: PointResult with its spectrum, fit and noise levels filled in
+        """
+        # Calculate SNR of the fit
+        result.SNR_stowed, result.SNR_silent = self.calculate_SNR(result, result.peak_params[0])
+
+        # Determine if the point should be approved
+        result.approved = self.is_approved(result.peak_params, result.FWHM, result.r_squared, result.SNR_stowed, result.SNR_silent)
+
+        return result
+
+    def process_point(self, ramanshift, point_index, spectrum_raw):
+        """
+        Runs the full automatic check on a single raw spectrum. Returns a fitted PointResult.
+
+        ramanshift: x-axis of the data, the ramanshift
+        point_index: index of the point within the scan
+        spectrum_raw: raw spectrum intensity of the point
+        """
+        result = self.prepare_point(point_index, spectrum_raw)
+
+        return self.fit_point(ramanshift, result)
+
+    def baseline_key(self):
+        """
+        Returns the settings that decide the baseline removed spectrums of a scan. Pipelines with the same key
+        can share the output of baseline_scan.
+        """
+        return (self.NOISE_SAMPLE, self.MHW, self.SHW, self.BASELINE_METHOD, self.COSMIC_RAY_THRESHOLD)
+
+    def clean_scan(self, spectrums, positions=None):
+        """
+        Removes the stowed arm noise median, and cosmic rays if COSMIC_RAY_THRESHOLD is set, from every raw
+        spectrum of a scan at once. Nothing here depends on the sampling and smoothing, so the result can be
+        baselined with several of them by baseline_cleaned. Returns a (n_points, n_channels) array of the cleaned
+        spectrums and the ray mask, which is None when cosmic ray removal is off.
+
+        spectrums: (n_points, n_channels) array of raw spectrum intensities
+        positions: optional (n_points, 2) array of point positions from load_positions
+        """
+        spectrums_stowed_arm_removed = Auto.stowed_arm_subtraction(np.asarray(spectrums, dtype=self.dtype), self.noise_sample)
+
+        # Replace the flagged cosmic ray channels before they can pull the baseline or a fit
+        ray_mask = self.detect_rays(spectrums, positions)
+        if ray_mask is not None:
+            points, lower, upper = Auto.ray_intervals(ray_mask)
+            Auto.replace_cosmic_rays(spectrums_stowed_arm_removed, lower, upper, points)
+
+        return spectrums_stowed_arm_removed, ray_mask
+
+    def baseline_cleaned(self, cleaned_scan):
+        """
+        Removes a baseline from every spectrum of a cleaned scan with this pipeline's sampling, smoothing and
+        baseline method. The cleaned spectrums are copied, so the same cleaned scan can be baselined again.
+        Returns the same tuple as baseline_scan.
+
+        cleaned_scan: tuple of the cleaned spectrums and ray mask returned by clean_scan
+        """
+        spectrums_stowed_arm_removed, ray_mask = cleaned_scan
+        spectrums_stowed_arm_removed = np.array(spectrums_stowed_arm_removed, dtype=self.dtype)
+        baselines, spectrums_baseline_removed = Auto.baselining_batch(spectrums_stowed_arm_removed, self.MHW, self.SHW, self.baseline_workers, self.baseline_pool, self.BASELINE_METHOD)
+
+        return spectrums_stowed_arm_removed, baselines, spectrums_baseline_removed, ray_mask
+
+    def baseline_scan(self, spectrums, positions=None):
+        """
+        Removes the stowed arm noise median, cosmic rays if COSMIC_RAY_THRESHOLD is set, and a baseline from
+        every raw spectrum of a scan at once. Returns (n_points, n_channels) arrays of the spectrums with the
+        stowed arm and rays removed, the baselines, the spectrums with the baseline removed, and the ray mask,
+        which is None when cosmic ray removal is off.
+
+        spectrums: (n_points, n_channels) array of raw spectrum intensities
+        positions: optional (n_points, 2) array of point positions from load_positions
+        """
+        return self.baseline_cleaned(self.clean_scan(spectrums, positions))
+
+    def fit_scan(self, ramanshift, baselined_scan, positions=None):
+        """
+        Peakfits, calculates the SNR of, and approves every point of a baselined scan. Yields a fitted PointResult
+        per point, in point order. The arrays of baselined_scan are only read, so they can be shared between
+        pipelines with the same baseline_key.
+
+        With batch_fit, all points are peakfit together by Auto.perform_peakfit_batch, otherwise each point is fit
+        on its own with Auto.perform_peakfit. With warm_start, the one at a time fits are run in the order of
+        Auto.warm_start_order and start from the fit of the closest point fitted before them. With prescreen, only
+        the points from prescreen_candidates are fit in any mode, the others get the all zeros of a failed fit.
+
+        ramanshift: x-axis of the data, the ramanshift
+        baselined_scan: tuple of arrays returned by baseline_scan
+        positions: optional (n_points, 2) array of point positions from load_positions, used by warm_start
+        """
+        spectrums_stowed_arm_removed, baselines, spectrums_baseline_removed, _ = baselined_scan
+
+        # Noise levels of every point in a single reduction each
+        noise_stowed_std = self.noise_library.stowed_std(self.NOISE_SAMPLE, ramanshift, self.CENTER)
+        noise_silent_std = Auto.calculate_noise_silent_region(ramanshift, spectrums_baseline_removed)
+        point_rows = self.noise_library.point_rows[self.NOISE_SAMPLE]
+
+        # Starting guesses of every point at once, None when fits use the default guess
+        guesses = self.initial_guesses(ramanshift, spectrums_baseline_removed)
+
+        # Points that are worth fitting, None when every point is
+        candidates = None
+        if self.prescreen:
+            point_noise_stowed_std = np.array([noise_stowed_std[point_rows[i]] for i in range(len(spectrums_baseline_removed))])
+            candidates = self.prescreen_candidates(ramanshift, spectrums_baseline_removed, point_noise_stowed_std, noise_silent_std)
+            self.fit_stats["skipped"] += int(np.sum(~candidates))
+
+        if self.batch_fit and len(spectrums_baseline_removed) > 0:
+            if candidates is None:
+                peak_params, FWHM, r_squared, cov = Auto.perform_peakfit_batch(ramanshift, spectrums_baseline_removed, self.ind1, self.ind2, self.CENTER, p0=guesses)
+            else:
+                peak_params, FWHM, r_squared, cov = self.fit_candidates_batch(ramanshift, spectrums_baseline_removed, candidates, guesses)
+        elif self.warm_start:
+            fits = self.fit_warm_started(ramanshift, spectrums_baseline_removed, positions, guesses, candidates)
+
+        for i in range(len(spectrums_baseline_removed)):
+            result = PointResult(i, spectrums_stowed_arm_removed[i], self.noise_library.point(self.NOISE_SAMPLE, i), self.MHW, self.SHW)
+            result.baseline, result.spectrum = baselines[i], spectrums_baseline_removed[i]
+
+            # Fit a gaussian curve to the data at our desired location
+            if self.batch_fit:
+                result.peak_params, result.FWHM, result.r_squared, result.cov = peak_params[i], FWHM[i], r_squared[i], cov[i]
+            elif self.warm_start:
+                result.peak_params, result.FWHM, result.r_squared, result.cov = fits[i]
+            elif candidates is not None and not candidates[i]:
+                result.peak_params, result.FWHM, result.r_squared, result.cov = self.skipped_fit()
+            else:
+                result.peak_params, result.FWHM, result.r_squared, result.cov = self.peakfit(ramanshift, result.spectrum, None if guesses is None else guesses[i])
+
+            result.noise_stowed_std = noise_stowed_std[point_rows[i]]
+            result.noise_silent_std = noise_silent_std[i]
+
+            yield self.score_point(result)
+
+    def prescreen_candidates(self, ramanshift, spectrums_baseline_removed, noise_stowed_std, noise_silent_std):
+        """
+        Finds the points of a scan worth peakfitting, in one pass over every point. An approved peak needs an
+        amplitude of SNR_THRESHOLD times the larger of its two noise levels and a center within CENTER_RANGE of
+        CENTER, so a point whose tallest channel there is below PRESCREEN_MARGIN of that height cannot be
+        approved. Returns a boolean array, True for every point that should be fit.
+
+        ramanshift: x-axis of the data, the ramanshift
+        spectrums_baseline_removed: (n_points, n_channels) array of baseline removed spectrums
+        noise_stowed_std: array with the stowed arm noise of every point
+        noise_silent_std: array with the silent region noise of every point
+        """
+        window = Axis.window(ramanshift, self.CENTER - self.CENTER_RANGE, self.CENTER + self.CENTER_RANGE)
+        spectrums = np.asarray(spectrums_baseline_removed)[:, window]
+        if spectrums.shape[1] == 0:
+            return np.ones(len(spectrums), dtype=bool)
+
+        # Points with a NaN noise level are always fit, like they were before
+        needed = self.SNR_THRESHOLD * np.maximum(noise_stowed_std, noise_silent_std)
+
+        return ~(np.max(spectrums, axis=1) < PRESCREEN_MARGIN * needed)
+
+    @staticmethod
+    def skipped_fit():
+        """
+        Returns the fit recorded for a point the prescreen left out, the all zeros of a failed Auto.perform_peakfit.
+        """
+        return np.zeros(3), 0.0, 0, np.zeros((3, 3))
+
+    def fit_candidates_batch(self, ramanshift, spectrums_baseline_removed, candidates, guesses=None):
+        """
+        Peakfits the prescreened points of a scan together with Auto.perform_peakfit_batch. Returns the same arrays
+        as Auto.perform_peakfit_batch for every point of the scan, with skipped_fit values for the others.
+
+        ramanshift: x-axis of the data, the ramanshift
+        spectrums_baseline_removed: (n_points, n_channels) array of baseline removed spectrums
+        candidates: boolean array of the points to fit from prescreen_candidates
+        guesses: optional (n_points, 3) array of starting guesses from initial_guesses
+        """
+        n_points = len(spectrums_baseline_removed)
+        peak_params, FWHM, r_squared, cov = np.zeros((n_points, 3)), np.zeros(n_points), np.zeros(n_points), np.zeros((n_points, 3, 3))
+
+        fit_points = np.flatnonzero(candidates)
+        if len(fit_points) > 0:
+            p0 = None if guesses is None else guesses[fit_points]
+            fits = Auto.perform_peakfit_batch(ramanshift, spectrums_baseline_removed[fit_points], self.ind1, self.ind2, self.CENTER, p0=p0)
+            peak_params[fit_points], FWHM[fit_points], r_squared[fit_points], cov[fit_points] = fits
+
+        return peak_params, FWHM, r_squared, cov
+
+    def initial_guesses(self, ramanshift, spectrums_baseline_removed):
+        """
+        Returns a (n_points, 3) array of the guess (amplitude, mean, sigma) each point's peakfit starts from with
+        the "analytic" PEAK_GUESS, from Auto.gaussian_guess_batch, or None with the "default" one.
+
+        ramanshift: x-axis of the data, the ramanshift
+        spectrums_baseline_removed: (n_points, n_channels) array of baseline removed spectrums
+        """
+        if self.PEAK_GUESS != "analytic" or len(spectrums_baseline_removed) == 0:
+            return None
+
+        guesses, _ = Auto.gaussian_guess_batch(ramanshift, spectrums_baseline_removed, self.ind1, self.ind2, self.CENTER)
+
+        return guesses
+
+    def peakfit(self, ramanshift, spectrum, p0=None):
+        """
+        Peakfits one baselined spectrum at CENTER with Auto.perform_peakfit and adds the fit to fit_stats, apart
+        from the seeded count which fit_warm_started keeps. Returns the same tuple as Auto.perform_peakfit.
+
+        ramanshift: x-axis of the data, the ramanshift
+        spectrum: baseline removed spectrum intensity of the point
+        p0: optional initial guess (amplitude, mean, sigma), the default guess is used without it
+        """
+        fit_info = {}
+        fit = Auto.perform_peakfit(ramanshift, spectrum, self.ind1, self.ind2, self.CENTER, p0, fit_info)
+
+        self.fit_stats["fits"] += 1
+        self.fit_stats["evaluations"] += fit_info["nfev"]
+        self.fit_stats["failed"] += fit_info["failed"]
+
+        return fit
+
+    def fit_warm_started(self, ramanshift, spectrums_baseline_removed, positions=None, guesses=None, candidates=None):
+        """
+        Peakfits every point of a scan one at a time, walking the map so each point is next to one fitted before
+        it and starting its fit from that neighbour's mean and sigma. A point whose neighbour has no peak within
+        the window and FWHM bounds starts from its own guess. Returns a list of Auto.perform_peakfit tuples in
+        point order.
+
+        ramanshift: x-axis of the data, the ramanshift
+        spectrums_baseline_removed: (n_points, n_channels) array of baseline removed spectrums
+        positions: optional (n_points, 2) array of point positions, the scan order is used without it
+        guesses: optional (n_points, 3) array of starting guesses from initial_guesses for unseeded points
+        candidates: optional boolean array of the points to fit from prescreen_candidates, the others get
+                    skipped_fit and never seed a neighbour
+        """
+        order, seeds = Auto.warm_start_order(len(spectrums_baseline_removed), positions)
+        window = Axis.window(ramanshift, self.ind1, self.ind2)
+
+        fits = [None] * len(spectrums_baseline_removed)
+        for point in order:
+            if candidates is not None and not candidates[point]:
+                fits[point] = self.skipped_fit()
+                continue
+
+            p0 = None if guesses is None else guesses[point]
+            if seeds[point] >= 0:
+                # Only seed from a neighbour whose peak landed inside the window with a believable width, a spike
+                # fit would pull every fit after it towards the same spike
+                (_, seed_mean, seed_sigma), seed_FWHM = fits[seeds[point]][:2]
+                if self.ind1 < seed_mean < self.ind2 and self.FWHM_MIN <= seed_FWHM <= self.FWHM_MAX:
+                    p0 = [np.max(spectrums_baseline_removed[point][window]), seed_mean, abs(seed_sigma)]
+                    self.fit_stats["seeded"] += 1
+
+            fits[point] = self.peakfit(ramanshift, spectrums_baseline_removed[point], p0)
+
+        return fits
+
+    def find_peaks(self, ramanshift, baselined_scan, low=250, high=4000):
+        """
+        Finds every significant peak of every point of a baselined scan, not only the one at CENTER. Peaks need a
+        smoothed SNR of at least the larger of SNR_THRESHOLD and PEAK_SNR_THRESHOLD, to be FWHM_MIN apart and at
+        least FWHM_MIN wide. Returns a dataframe with the PEAK_COLUMNS and a row per peak, sorted by point then
+        center. When the pipeline has a catalog, a Minerals column lists the minerals each peak could belong to
+        separated by ';'.
+
+        ramanshift: x-axis of the data, the ramanshift
+        baselined_scan: tuple of arrays returned by baseline_scan
+        low: lower ramanshift bound of the search
+        high: upper ramanshift bound of the search
+        """
+        spectrums_baseline_removed = baselined_scan[2]
+        snr_threshold = max(self.SNR_THRESHOLD, PEAK_SNR_THRESHOLD)
+
+        points, centers, heights, FWHMs, SNRs = Auto.find_peaks_batch(ramanshift, spectrums_baseline_removed, snr_threshold, low, high, self.FWHM_MIN, self.FWHM_MIN, self.FWHM_MAX)
+        peak_df = pd.DataFrame({"Point": points, "Center": centers, "Height": heights, "FWHM": FWHMs, "SNR": SNRs}, columns=PEAK_COLUMNS)
+
+        if self.catalog is not None:
+            matches = self.catalog.lookup_many(centers, FWHMs)
+            peak_df["Minerals"] = [";".join(dict.fromkeys(name for name, _ in match)) for match in matches]
+
+        return peak_df
+
+    def scan_peaks(self, file_path):
+        """
+        Loads and baselines a Full Map file and finds every significant peak of every point, without fitting.
+        Returns the peak table dataframe from find_peaks.
+
+        file_path: string with directory to a ZNZ csv file
+        """
+        ramanshift, spectrums = self.load_scan(file_path)
+        positions = self.load_positions(file_path, len(spectrums))
+
+        return self.find_peaks(ramanshift, self.baseline_scan(spectrums, positions))
+
+    def process_scan(self, ramanshift, spectrums, positions=None):
+        """
+        Runs the full automatic check on every raw spectrum of a scan. Yields a fitted PointResult per point, in
+        point order.
+
+        ramanshift: x-axis of the data, the ramanshift
+        spectrums: (n_points, n_channels) array of raw spectrum intensities
+        positions: optional (n_points, 2) array of point positions from load_positions
+        """
+        if len(spectrums) == 0:
+            return
+
+        yield from self.fit_scan(ramanshift, self.baseline_scan(spectrums, positions), positions)
+
+    def is_approved(self, peak_params, FWHM, r_squared, SNR_stowed, SNR_silent):
+        """
+        Applies the user thresholds to a fit. Returns True if the point should be approved.
+
+        peak_params: gaussian fit parameters (amplitude, mean, sigma)
+        FWHM: full width at half max of the fit
+        r_squared: coefficient of determination of the fit
+        SNR_stowed: signal-to-noise ratio from the stowed arm scan
+        SNR_silent: signal-to-noise ratio from the silent region
+        """
+        return (min(SNR_stowed, SNR_silent) > self.SNR_THRESHOLD
+                and r_squared > self.R_SQUARED_THRESHOLD
+                and FWHM > self.FWHM_MIN and FWHM < self.FWHM_MAX
+                and peak_params[1] > self.CENTER - self.CENTER_RANGE
+                and peak_params[1] < self.CENTER + self.CENTER_RANGE)
+
+    def is_approved_batch(self, peak_params, FWHM, r_squared, SNR_stowed, SNR_silent):
+        """
+        Applies the user thresholds to the fits of many points at once, the same way as is_approved. Returns a
+        boolean array with True for every point that should be approved.
+
+        peak_params: (n_points, 3) array of gaussian fit parameters (amplitude, mean, sigma)
+        FWHM: array of full width at half max of the fits
+        r_squared: array of coefficient of determination of the fits
+        SNR_stowed: array of signal-to-noise ratios from the stowed arm scan
+        SNR_silent: array of signal-to-noise ratios from the silent region
+        """
+        # Same as min(SNR_stowed, SNR_silent), including which one is kept when one of them is NaN
+        SNR = np.where(SNR_silent < SNR_stowed, SNR_silent, SNR_stowed)
+
+        return ((SNR > self.SNR_THRESHOLD)
+                & (r_squared > self.R_SQUARED_THRESHOLD)
+                & (FWHM > self.FWHM_MIN) & (FWHM < self.FWHM_MAX)
+                & (peak_params[:, 1] > self.CENTER - self.CENTER_RANGE)
+                & (peak_params[:, 1] < self.CENTER + self.CENTER_RANGE))
+
+    @staticmethod
+    def result_row(point_index, peak_params, cov, FWHM, r_squared, SNR_stowed, SNR_silent):
+        """
+        Builds a result row with the same columns as the exported dataframes.
+
+        point_index: index of the point within the scan
+        peak_params: gaussian fit parameters (amplitude, mean, sigma)
+        cov: covariance matrix of the fit
+        FWHM: full width at half max of the fit
+        r_squared: coefficient of determination of the fit
+        SNR_stowed: signal-to-noise ratio from the stowed arm scan
+        SNR_silent: signal-to-noise ratio from the silent region
+        """
+        # Find standard deviation of the covariance
+        std = np.sqrt(np.diag(cov))
+
+        return {
+            "Point" : point_index,
+            "Height" : peak_params[0],
+            "Height STD" : std[0],
+            "Mean" : peak_params[1],
+            "Mean STD" : std[1],
+            "Sigma" : peak_params[2],
+            "Sigma STD" : std[2],
+            "FWHM" : FWHM,
+            "R^2" : r_squared,
+            "Stowed SNR" : SNR_stowed,
+            "Silent SNR" : SNR_silent
+        }
+
+    def run(self, file_path):
+        """
+        Runs the automatic check on every point of a Full Map file. Returns the approved and denied ResultTables.
+
+        file_path: string with directory to a ZNZ csv file
+        """
+        ramanshift, spectrums = self.load_scan(file_path)
+        positions = self.load_positions(file_path, len(spectrums))
+
+        return self.tabulate(self.process_scan(ramanshift, spectrums, positions), len(spectrums))
+
+    def tabulate(self, results, capacity=100):
+        """
+        Sorts fitted points into result tables. Returns the approved and denied ResultTables.
+
+        results: iterable of fitted PointResults
+        capacity: number of rows to allocate up front, usually the number of points in the scan
+        """
+        approved_results = ResultTable(capacity)
+        denied_results = ResultTable(capacity)
+        for result in results:
+            row = self.result_row(result.point_index, result.peak_params, result.cov, result.FWHM, result.r_squared, result.SNR_stowed, result.SNR_silent)
+
+            if result.approved:
+                approved_results.append(row)
+            else:
+                denied_results.append(row)
+
+        return approved_results, denied_results
+
+    def reclassify(self, fits):
+        """
+        Applies this pipeline's thresholds to the stored fits of a scan without baselining or fitting. Returns the
+        approved and denied ResultTables.
+
+        fits: dictionary of stored arrays from Store.FitStore.load
+        """
+        peak_params = fits["peak_params"]
+        std = np.sqrt(np.diagonal(fits["cov"], axis1=1, axis2=2))
+
+        # Columns in RESULT_COLUMNS order
+        values = np.column_stack([fits["point"], peak_params[:, 0], std[:, 0], peak_params[:, 1], std[:, 1], peak_params[:, 2], std[:, 2], fits["FWHM"], fits["r_squared"], fits["SNR_stowed"], fits["SNR_silent"]])
+        approved = self.is_approved_batch(peak_params, fits["FWHM"], fits["r_squared"], fits["SNR_stowed"], fits["SNR_silent"])
+
+        return ResultTable.from_values(values[approved]), ResultTable.from_values(values[~approved])
+
+    def export(self, approved_results, denied_results, file_path, user_path):
+        """
+        Writes the result tables of a scan to the results folder of this pipeline's mineral. Returns the created
+        folder path.
+
+        approved_results: ResultTable of approved points
+        denied_results: ResultTable of denied points
+        file_path: string with directory to the Full Map ZNZ csv file the results came from
+        user_path: string with directory to the User folder
+        """
+        return Helper.export_results(approved_results.to_dataframe(), denied_results.to_dataframe(), file_path, self.MINERAL_NAME, user_path)
+
+class MineralPipelines:
+    def __init__(self, pipelines, fit_store=None):
+        """
+        Runs the automatic check for several minerals in a single pass over each scan. A scan is loaded once and
+        baselined once per distinct baseline setting (noise sample, sampling, smoothing and baseline method), and
+        every mineral's peak window is then fit against the shared baseline removed spectrums.
+
+        pipelines: list of SpectrumPipelines, one per mineral, in the order results are returned
+        fit_store: optional Store.FitStore the fits of every scan are saved to, so they can be reclassified later
+        """
+        self.pipelines = pipelines
+        self.fit_store = fit_store
+
+    @classmethod
+    def from_user_folder(cls, user_path, cache_bytes=1024**3, batch_fit=False, baseline_workers=1, baseline_pool="thread", fit_store=False, warm_start=False, prescreen=False, dtype=np.float64):
+        """
+        Builds one pipeline per row of the Settings.csv of a User folder, filled in from the Minerals.csv catalog
+        like SpectrumPipeline.from_user_folder. The noise samples and file cache are shared between them.
+
+        user_path: string with directory to the User folder
+        cache_bytes: maximum size of the User/Cache folder parsed Full Map files are cached in, 0 disables it
+        batch_fit: fit every point of a scan at once with Auto.perform_peakfit_batch
+        baseline_workers: number of threads or processes used to baseline the points of a scan
+        baseline_pool: "thread" or "process", the kind of pool used when baseline_workers is more than 1
+        fit_store: save the fits of every scan to the User/FitStore folder
+        warm_start: fit the points of a scan in spatial order, each starting from its closest fitted neighbour
+        prescreen: skip the peakfit of points too low near CENTER to ever pass each mineral's SNR_THRESHOLD
+        dtype: floating point type scans are loaded, cleaned and baselined in, np.float64 or np.float32
+        """
+        noise_library = Noise.NoiseLibrary(os.path.join(user_path, "Noise"))
+        cache = Cache.SpectraCache(os.path.join(user_path, "Cache"), cache_bytes) if cache_bytes > 0 else None
+        store = Store.FitStore(os.path.join(user_path, "FitStore")) if fit_store else None
+
+        catalog = Catalog.MineralCatalog.from_user_folder(user_path)
+        all_settings = Helper.load_all_settings(user_path)
+        if catalog is not None:
+            all_settings = [catalog.settings_for(settings) for settings in all_settings]
+
+        return cls([SpectrumPipeline(settings, noise_library, cache, batch_fit, baseline_workers, baseline_pool, catalog=catalog, warm_start=warm_start, prescreen=prescreen, dtype=dtype) for settings in all_settings], store)
+
+    def run(self, file_path, peaks=False):
+        """
+        Runs the automatic check for every mineral on every point of a Full Map file. Returns a list with an
+        (approved ResultTable, denied ResultTable) tuple per pipeline, and the peak table of the scan if peaks is
+        set, otherwise None.
+
+        file_path: string with directory to a ZNZ csv file
+        peaks: also find every significant peak of the scan with the first pipeline's settings
+        """
+        ramanshift, spectrums = self.pipelines[0].load_scan(file_path)
+        positions = None
+
+        # Baseline the scan once for every distinct baseline setting
+        baselined_scans = {}
+        tables = []
+        for pipeline in self.pipelines:
+            key = pipeline.baseline_key()
+            if key not in baselined_scans:
+                if positions is None:
+                    positions = pipeline.load_positions(file_path, len(spectrums))
+                baselined_scans[key] = pipeline.baseline_scan(spectrums, positions)
+            elif positions is None and pipeline.warm_start:
+                positions = pipeline.load_positions(file_path, len(spectrums))
+
+            results = list(pipeline.fit_scan(ramanshift, baselined_scans[key], positions))
+            tables.append(pipeline.tabulate(results, len(spectrums)))
+
+            if self.fit_store is not None:
+                self.fit_store.save(pipeline, file_path, results)
+
+        peak_table = None
+        if peaks:
+            first = self.pipelines[0]
+            peak_table = first.find_peaks(ramanshift, baselined_scans[first.baseline_key()])
+
+        return tables, peak_table
+
+    def fit_stats(self):
+        """
+        Returns the fit_stats of every pipeline added together.
+        """
+        return {name: sum(pipeline.fit_stats[name] for pipeline in self.pipelines) for name in self.pipelines[0].fit_stats}
+
+    def export(self, tables, file_path, user_path, peak_table=None):
+        """
+        Writes the result tables of a scan to the results folder of each mineral, and the peak table to the Peaks
+        results folder if given. Returns a list of the created folder paths.
+
+        tables: list of (approved ResultTable, denied ResultTable) tuples as returned by run
+        file_path: string with directory to the Full Map ZNZ csv file the results came from
+        user_path: string with directory to the User folder
+        peak_table: optional peak table dataframe as returned by run
+        """
+        if peak_table is not None:
+            Helper.export_peaks(peak_table, file_path, user_path)
+
+        return [pipeline.export(approved_results, denied_results, file_path, user_path) for pipeline, (approved_results, denied_results) in zip(self.pipelines, tables)]
+
+    def reclassify(self, user_path):
+        """
+        Applies the current thresholds of every mineral to all of its stored fits and exports new result tables,
+        without baselining or fitting. Stored fits made with a different CENTER, noise sample, baseline method or
+        cosmic ray threshold are skipped, since only a new run can update them. Returns a list of (mineral name,
+        file path, approved count, point count) tuples, one per reclassified scan and mineral, and a list of the
+        (mineral name, entry path) of every skipped entry.
+
+        user_path: string with directory to the User folder
+        """
+        summary = []
+        skipped = []
+        for pipeline in self.pipelines:
+            for entry_path in self.fit_store.entries(pipeline.MINERAL_NAME):
+                fits = Store.FitStore.load(entry_path)
+                if not Store.FitStore.matches(pipeline, fits):
+                    skipped.append((pipeline.MINERAL_NAME, entry_path))
+                    continue
+
+                approved_results, denied_results = pipeline.reclassify(fits)
+                pipeline.export(approved_results, denied_results, fits["file_path"], user_path)
+                summary.append((pipeline.MINERAL_NAME, fits["file_path"], len(approved_results), len(approved_results) + len(denied_results)))
+
+        return summary, skipped
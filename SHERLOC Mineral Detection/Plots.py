@@ -3,6 +3,7 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from abc import ABC, abstractmethod
 
+import Axis
 import Helper
 
 class PlotObject(ABC):
@@ -73,7 +74,7 @@ class BaselinePlot(PlotObject):
         self.plot_area.legend(framealpha=0.0, labelcolor="white", loc="lower right")
 
         # Isolate all x values that fall within the indices
-        ind = (ramanshift > max(ind1 - 1500, 250)) & (ramanshift < ind2 + 1500)
+        ind = Axis.window(ramanshift, max(ind1 - 1500, 250), ind2 + 1500)
 
         self.bottom_plot_area.clear()
         self.bottom_plot_area.plot(ramanshift[ind], spectrum[ind] + baseline[ind], label="Original Spectrum", lw=0.5, color="white")
@@ -125,10 +126,10 @@ class NoisePlot(PlotObject):
         center: location of the peak center
         """
         # Isolate all x values that fall within the silent region
-        ind_silent = (ramanshift > 2000) & (ramanshift < 2100)
+        ind_silent = Axis.window(ramanshift, 2000, 2100)
         
         # Isolate all x values that fall in the region around our scan
-        ind_stowed = (ramanshift > max(center - 200, 700)) & (ramanshift < center + 200)
+        ind_stowed = Axis.window(ramanshift, max(center - 200, 700), center + 200)
 
         self.plot_area.clear()
         self.plot_area.plot(ramanshift[ind_silent], spectrum[ind_silent], label="Silent Region", lw=0.5, color="white")
@@ -176,7 +177,7 @@ class CosmicRayPlot(PlotObject):
         upper_ray_index: upper x value index of the cosmic ray
         """
         # Isolate all x values that fall within the indices
-        ind = (ramanshift > lower_display) & (ramanshift < upper_display)
+        ind = Axis.window(ramanshift, lower_display, upper_display, cache=False)
 
         self.plot_area.clear()
         self.plot_area.plot(ramanshift[ind], spectrum[ind], label="Spectrum", lw=0.5, color="white")
@@ -217,7 +218,7 @@ class PeakfitPlot(PlotObject):
         # Isolate all x values that fall within the indices
         lower = max(ind1 - 250, 250)
         upper = min(ind2 + 250, 4000)
-        ind = (ramanshift > lower) & (ramanshift < upper)
+        ind = Axis.window(ramanshift, lower, upper)
             
         #x data for plotting gaussian curve
         gauss_x = np.arange(lower, upper, 1)
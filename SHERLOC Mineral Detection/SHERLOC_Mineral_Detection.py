@@ -10,8 +10,10 @@ from collections import defaultdict
 
 import Plots
 import Auto
+import Axis
 import Helper
 import Results
+import Pipeline
 
 class MainApp:
     def __init__(self, root):
@@ -38,51 +40,31 @@ class MainApp:
         else:
             self.textcolor = "black"
 
-        # Unpack user settings
-        user_path = os.path.join(os.getcwd(), "User")
-        settings_path = os.path.join(user_path, "Settings.csv")
-        settings_df = pd.read_csv(settings_path)
+        # Unpack user settings and build the processing pipeline, a peak window left blank in Settings.csv comes
+        # from the Minerals.csv catalog when it has the selected mineral
+        self.user_path = os.path.join(os.getcwd(), "User")
+        self.pipeline = Pipeline.SpectrumPipeline.from_user_folder(self.user_path, baseline_cache_bytes=256 * 1024**2)
 
         # Parameter constants
-        self.SNR_THRESHOLD = settings_df["SNR_THRESHOLD"][0]
-        self.R_SQUARED_THRESHOLD = settings_df["R_SQUARED_THRESHOLD"][0]
-        self.FWHM_MIN = settings_df["FWHM_MIN"][0]
-        self.FWHM_MAX = settings_df["FWHM_MAX"][0]
-        self.CENTER_RANGE = settings_df["CENTER_RANGE"][0]
-        self.MHW = settings_df["SAMPLING"][0]
-        self.SHW = settings_df["SMOOTHING"][0]
-        self.MINERAL_NAME = settings_df["MINERAL_NAME"][0]
-        self.CENTER = settings_df["CENTER"][0]
-
-        # Load in the user selected noise dataframe
-        folder_path = os.path.join(user_path, "Noise")
-        folder_path = os.path.join(folder_path, settings_df["NOISE_SAMPLE"][0] + ".csv")
-        self.noise_df = pd.read_csv(folder_path)
-
-        # Result dataframes setup
-        result_dict = {
-            "Point" : [],
-            "Height" : [],
-            "Height STD" : [],
-            "Mean" : [],
-            "Mean STD" : [],
-            "Sigma" : [],
-            "Sigma STD": [],
-            "FWHM" : [],
-            "R^2" : [],
-            "Stowed SNR" : [],
-            "Silent SNR" : []
-        }
-
-        self.fresh_df = pd.DataFrame(result_dict)
-        self.approved_result_df = pd.DataFrame(result_dict)
-        self.denied_result_df = pd.DataFrame(result_dict)
+        self.SNR_THRESHOLD = self.pipeline.SNR_THRESHOLD
+        self.R_SQUARED_THRESHOLD = self.pipeline.R_SQUARED_THRESHOLD
+        self.FWHM_MIN = self.pipeline.FWHM_MIN
+        self.FWHM_MAX = self.pipeline.FWHM_MAX
+        self.CENTER_RANGE = self.pipeline.CENTER_RANGE
+        self.MHW = self.pipeline.MHW
+        self.SHW = self.pipeline.SHW
+        self.MINERAL_NAME = self.pipeline.MINERAL_NAME
+        self.CENTER = self.pipeline.CENTER
+
+        # Result tables setup
+        self.approved_results = Pipeline.ResultTable()
+        self.denied_results = Pipeline.ResultTable()
 
         # Instance variables and root setup
         self.file_pressed = False
         self.file_selected = None
-        self.ind1 = self.CENTER - 150
-        self.ind2 = self.CENTER + 150
+        self.ind1 = self.pipeline.ind1
+        self.ind2 = self.pipeline.ind2
         self.root = root
         self.root.title("SHERLOC Mineral Detection")
         self.root.config(bg="#2B2B2B")
@@ -123,6 +105,25 @@ class MainApp:
         std = [x if x <= 10000 else np.nan for x in std]
         self.data_label.config(text=f"CURRENT DATA\n\nHeight: {round(self.peak_params[0], 1)} \u00B1\n{round(std[0], 1)}\n\nMean: {round(self.peak_params[1], 1)} \u00B1\n{round(std[1], 1)}\n\nSigma: {round(self.peak_params[2], 1)} \u00B1\n{round(std[2], 1)}\n\nFWHM: {round(self.FWHM, 1)}\n\nR\u00B2 : {round(self.r_squared, 4)}\n\nStow SNR: {round(self.SNR_stowed, 2)}\n\nSilent SNR: {round(self.SNR_silent, 2)}\n\nSampling: {self.sampling}\n\nSmoothing: {self.smoothing}\n\n")
 
+    def _fit_point(self):
+        """
+        Helper function that baselines, peakfits and calculates the SNR of the current point through the pipeline
+        using the current spectrum, sampling, and smoothing.
+        """
+        self.point.spectrum_stowed_arm_removed = self.spectrum_stowed_arm_removed
+        self.point.sampling = self.sampling
+        self.point.smoothing = self.smoothing
+        self.pipeline.fit_point(self.ramanshift, self.point)
+
+        self.baseline = self.point.baseline
+        self.spectrum = self.point.spectrum
+        self.peak_params = self.point.peak_params
+        self.FWHM = self.point.FWHM
+        self.r_squared = self.point.r_squared
+        self.cov = self.point.cov
+        self.SNR_stowed = self.point.SNR_stowed
+        self.SNR_silent = self.point.SNR_silent
+
     def show_buttons(self):
         """
         Displays the selection screen to the user. Allows them to load a sample file and select a scan type.
@@ -247,15 +248,8 @@ class MainApp:
             self.smoothing = int(request_input("Smoothing:", lambda x: x.isdigit()))
             self._update_data()
         
-            # Calculate and remove a baseline
-            self.baseline, self.spectrum = Auto.baselining(self.spectrum_stowed_arm_removed, self.sampling, self.smoothing)
-        
-            # Fit a gaussian curve to the data at our desired location
-            self.peak_params, self.FWHM, self.r_squared, self.cov = Auto.perform_peakfit(self.ramanshift, self.spectrum, self.ind1, self.ind2, self.CENTER)
-        
-            # Calculate SNR of the fit
-            self.SNR_stowed = Auto.calculate_SNR_stowed_arm(self.ramanshift, self.cur_noise, self.peak_params[0], self.CENTER)
-            self.SNR_silent = Auto.calculate_SNR_silent_region(self.ramanshift, self.spectrum, self.peak_params[0])
+            # Rebaseline, refit and recalculate SNR with the new settings
+            self._fit_point()
 
             # Update the plots
             self.baseline_display.update_data(self.ramanshift, self.spectrum, self.baseline, self.ind1, self.ind2)
@@ -298,21 +292,11 @@ class MainApp:
 
             loop = True
             if selection == "A":
-                # Calculate linear replacement for peak (change in y/change in x)
-                replacement_slope = (self.spectrum_stowed_arm_removed[self.cosmic_lower_index] - self.spectrum_stowed_arm_removed[self.cosmic_upper_index]) / (self.cosmic_lower_index - self.cosmic_upper_index)
-    
-                for i in range(self.cosmic_lower_index + 1, self.cosmic_upper_index):
-                    self.spectrum_stowed_arm_removed[i] = self.spectrum_stowed_arm_removed[i - 1] + replacement_slope
-        
-                # Calculate and remove a baseline
-                self.baseline, self.spectrum = Auto.baselining(self.spectrum_stowed_arm_removed, self.sampling, self.smoothing)
-        
-                # Fit a gaussian curve to the data at our desired location
-                self.peak_params, self.FWHM, self.r_squared, self.cov = Auto.perform_peakfit(self.ramanshift, self.spectrum, self.ind1, self.ind2, self.CENTER)
-        
-                # Calculate SNR of the fit
-                self.SNR_stowed = Auto.calculate_SNR_stowed_arm(self.ramanshift, self.cur_noise, self.peak_params[0], self.CENTER)
-                self.SNR_silent = Auto.calculate_SNR_silent_region(self.ramanshift, self.spectrum, self.peak_params[0])
+                # Replace the ray with a straight line between the selected channels
+                Auto.replace_cosmic_rays(self.spectrum_stowed_arm_removed, self.cosmic_lower_index, self.cosmic_upper_index)
+
+                # Rebaseline, refit and recalculate SNR without the ray
+                self._fit_point()
             
                 # Update plots
                 self.baseline_display.update_data(self.ramanshift, self.spectrum, self.baseline, self.ind1, self.ind2)
@@ -401,7 +385,7 @@ class MainApp:
                 loop = False
 
             # Narrow down x and y values to ones surrounding the peak
-            ind_fit = (self.ramanshift > self.peak_params[1] - self.peak_params[2]*R_SQUARED_CALC_RANGE) & (self.ramanshift < self.peak_params[1] + self.peak_params[2]*R_SQUARED_CALC_RANGE)
+            ind_fit = Axis.window(self.ramanshift, self.peak_params[1] - self.peak_params[2]*R_SQUARED_CALC_RANGE, self.peak_params[1] + self.peak_params[2]*R_SQUARED_CALC_RANGE, cache=False)
             peak_ramanshift = self.ramanshift[ind_fit]
             peak_spectrum = self.spectrum[ind_fit]
 
@@ -415,8 +399,7 @@ class MainApp:
             self.FWHM = WIDTH_APPROXIMATION * self.peak_params[2]
 
             # Calculate SNR of the fit
-            self.SNR_stowed = Auto.calculate_SNR_stowed_arm(self.ramanshift, self.cur_noise, self.peak_params[0], self.CENTER)
-            self.SNR_silent = Auto.calculate_SNR_silent_region(self.ramanshift, self.spectrum, self.peak_params[0])
+            self.SNR_stowed, self.SNR_silent = self.pipeline.calculate_SNR(self.point, self.peak_params[0])
 
             # Update the graph
             self.peakfit.update_data(self.ramanshift, self.spectrum, self.peak_params, self.ind1, self.ind2)
@@ -458,9 +441,9 @@ class MainApp:
                 other_center = float(request_input("Other Peak:", lambda x: x.replace('.', '', 1).isdigit()))
 
                 # Perform a double peak fit, update the graphs and data
-                self.peak_params, other_params, self.FWHM, self.r_squared, cov = Auto.perform_double_peakfit(self.ramanshift, self.spectrum, self.ind1, self.ind2, self.CENTER, other_center)
-                self.SNR_stowed = Auto.calculate_SNR_stowed_arm(self.ramanshift, self.cur_noise, self.peak_params[0], self.CENTER)
-                self.SNR_silent = Auto.calculate_SNR_silent_region(self.ramanshift, self.spectrum, self.peak_params[0])
+                p0 = Auto.double_gaussian_guess(self.ramanshift, self.spectrum, self.ind1, self.ind2, self.CENTER, other_center) if self.pipeline.PEAK_GUESS == "analytic" else None
+                self.peak_params, other_params, self.FWHM, self.r_squared, cov = Auto.perform_double_peakfit(self.ramanshift, self.spectrum, self.ind1, self.ind2, self.CENTER, other_center, p0)
+                self.SNR_stowed, self.SNR_silent = self.pipeline.calculate_SNR(self.point, self.peak_params[0])
                 self.peakfit.update_data(self.ramanshift, self.spectrum, self.peak_params, self.ind1, self.ind2, other_params)
                 self._update_data()
 
@@ -514,7 +497,7 @@ class MainApp:
                 self.cov = stored[1]
             
                 # Narrow down x and y values to ones surrounding the peak
-                ind_fit = (self.ramanshift > self.peak_params[1] - self.peak_params[2]*R_SQUARED_CALC_RANGE) & (self.ramanshift < self.peak_params[1] + self.peak_params[2]*R_SQUARED_CALC_RANGE)
+                ind_fit = Axis.window(self.ramanshift, self.peak_params[1] - self.peak_params[2]*R_SQUARED_CALC_RANGE, self.peak_params[1] + self.peak_params[2]*R_SQUARED_CALC_RANGE, cache=False)
                 peak_ramanshift = self.ramanshift[ind_fit]
                 peak_spectrum = self.spectrum[ind_fit]
 
@@ -528,8 +511,7 @@ class MainApp:
                 self.FWHM = WIDTH_APPROXIMATION * self.peak_params[2]
 
                 # Calculate SNR of the fit
-                self.SNR_stowed = Auto.calculate_SNR_stowed_arm(self.ramanshift, self.cur_noise, self.peak_params[0], self.CENTER)
-                self.SNR_silent = Auto.calculate_SNR_silent_region(self.ramanshift, self.spectrum, self.peak_params[0])
+                self.SNR_stowed, self.SNR_silent = self.pipeline.calculate_SNR(self.point, self.peak_params[0])
 
                 # Update the graph
                 self.peakfit.update_data(self.ramanshift, self.spectrum, self.peak_params, self.ind1, self.ind2)
@@ -544,7 +526,7 @@ class MainApp:
                 return
 
             # Narrow down x and y values to ones surrounding the peak
-            ind_fit = (self.ramanshift > left_params[1] - left_params[2]*R_SQUARED_CALC_RANGE) & (self.ramanshift < right_params[1] + right_params[2]*R_SQUARED_CALC_RANGE)
+            ind_fit = Axis.window(self.ramanshift, left_params[1] - left_params[2]*R_SQUARED_CALC_RANGE, right_params[1] + right_params[2]*R_SQUARED_CALC_RANGE, cache=False)
             peak_ramanshift = self.ramanshift[ind_fit]
             peak_spectrum = self.spectrum[ind_fit]
 
@@ -558,8 +540,7 @@ class MainApp:
             self.FWHM = WIDTH_APPROXIMATION * self.peak_params[2]
 
             # Calculate SNR of the fit
-            self.SNR_stowed = Auto.calculate_SNR_stowed_arm(self.ramanshift, self.cur_noise, self.peak_params[0], self.CENTER)
-            self.SNR_silent = Auto.calculate_SNR_silent_region(self.ramanshift, self.spectrum, self.peak_params[0])
+            self.SNR_stowed, self.SNR_silent = self.pipeline.calculate_SNR(self.point, self.peak_params[0])
 
             # Update the graph
             self.peakfit.update_data(self.ramanshift, self.spectrum, self.peak_params, self.ind1, self.ind2, other_params)
@@ -676,91 +657,41 @@ class MainApp:
         """
         Scans through each point in the user selected dataframe and handles adjustments as necessary.
         """
-        def append_df(point_index):
+        def append_result(point_index):
             """
-            Helper function to add current point settings to a desired dataframe.
+            Helper function to add current point settings to a desired result table.
 
             point_index: index of the current point being looked at
             """
-            # Find standard deviation of the covariance
-            std = np.sqrt(np.diag(self.cov))
-
-            # Create the new row to be entered        
-            new_row = {
-                "Point" : point_index,
-                "Height" : self.peak_params[0],
-                "Height STD" : std[0],
-                "Mean" : self.peak_params[1],
-                "Mean STD" : std[1],
-                "Sigma" : self.peak_params[2],
-                "Sigma STD" : std[2],
-                "FWHM" : self.FWHM,
-                "R^2" : self.r_squared,
-                "Stowed SNR" : self.SNR_stowed,
-                "Silent SNR" : self.SNR_silent
-            }
-            new_row = pd.DataFrame.from_dict(new_row, orient='index').T
-
-            # Add it to the appropriate dataframe
+            # Create the new row to be entered
+            new_row = Pipeline.SpectrumPipeline.result_row(point_index, self.peak_params, self.cov, self.FWHM, self.r_squared, self.SNR_stowed, self.SNR_silent)
+
+            # Add it to the appropriate table
             if self.approved:
-                self.approved_result_df = pd.concat([self.approved_result_df, new_row], ignore_index=True)
+                self.approved_results.append(new_row)
             else:
-                self.denied_result_df = pd.concat([self.denied_result_df, new_row], ignore_index=True)
+                self.denied_results.append(new_row)
 
-        def export_dfs():
+        def export_results():
             """
-            Exports both dataframes in their current state to the results folder and resets them to empty.
+            Exports both result tables in their current state to the results folder and resets them to empty.
             """
+            self.pipeline.export(self.approved_results, self.denied_results, self.file_selected, self.user_path)
 
-            # Split our known working directory to access naming information
-            split_path = self.file_selected.split('/')
-
-            # Store the scan name and scan type
-            scan_name = split_path[-6]
-            scan_type = split_path[-5]
-
-            # Build a file name
-            file_name = scan_name + '-' + scan_type
-
-            # Initialize folder count, will be incremented until no longer matches existing folders in user's files
-            folder_count = 1
-
-            # Create a result directory if needed
-            result_directory = os.path.join(os.getcwd(), "User")
-            result_directory = os.path.join(result_directory, "Results")
-            result_directory = os.path.join(result_directory, self.MINERAL_NAME)
-            if not os.path.exists(result_directory):
-                os.makedirs(result_directory)
-
-            # Increment the folder counter until we create a unique folder name
-            folder_path = os.path.join(result_directory, file_name + '_' + str(folder_count))
-            while os.path.exists(folder_path):
-                folder_count += 1
-                folder_path = os.path.join(result_directory, file_name + '_' + str(folder_count))
-
-            # Create the folder path
-            os.makedirs(folder_path)
-
-            # Initialize our file paths and store results
-            approved_file = os.path.join(folder_path, file_name + '_Approved.csv')
-            denied_file = os.path.join(folder_path, file_name + '_Denied.csv')
-            self.approved_result_df.to_csv(approved_file, index=False)
-            self.denied_result_df.to_csv(denied_file, index=False)
-
-            self.approved_result_df = self.fresh_df
-            self.denied_result_df = self.fresh_df
+            self.approved_results = Pipeline.ResultTable(len(self.spectrums))
+            self.denied_results = Pipeline.ResultTable(len(self.spectrums))
 
         # Unpack the sample dataframe
-        self.ramanshift, self.spectrums = Helper.process_ZNZ_dataframe(self.file_selected)
-        
-        # Store a median noise sample for subtraction
-        self.noise_sample = np.array(self.noise_df.median(axis=1))
+        self.ramanshift, self.spectrums = self.pipeline.load_scan(self.file_selected)
+
+        # Flag the cosmic rays of every point at once if automatic removal is on
+        positions = self.pipeline.load_positions(self.file_selected, len(self.spectrums))
+        self.ray_mask = self.pipeline.detect_rays(self.spectrums, positions)
 
         # Disable the buttons until needed
         self._toggle_buttons(tk.DISABLED)
 
         for i, spectrum_raw in enumerate(self.spectrums):
-            spectrum_raw = pd.to_numeric(spectrum_raw)
             # Initialize the cosmic plot initial settings
             self.cosmic_display_lower = self.ind1
             self.cosmic_display_upper = self.ind2
@@ -771,28 +702,16 @@ class MainApp:
             self.sampling = self.MHW
             self.smoothing = self.SHW
 
-            # Store current noise
-            self.cur_noise = self.noise_df[f"Point {i}"]
-        
-            # Remove stowed arm noise median
-            self.spectrum_stowed_arm_removed = Auto.stowed_arm_subtraction(spectrum_raw, self.noise_sample)
-        
-            # Calculate and remove a baseline
-            self.baseline, self.spectrum = Auto.baselining(self.spectrum_stowed_arm_removed, self.sampling, self.smoothing)
-        
-            # Fit a gaussian curve to the data at our desired location
-            self.peak_params, self.FWHM, self.r_squared, self.cov = Auto.perform_peakfit(self.ramanshift, self.spectrum, self.ind1, self.ind2, self.CENTER)
-        
-            # Calculate SNR of the fit
-            self.SNR_stowed = Auto.calculate_SNR_stowed_arm(self.ramanshift, self.cur_noise, self.peak_params[0], self.CENTER)
-            self.SNR_silent = Auto.calculate_SNR_silent_region(self.ramanshift, self.spectrum, self.peak_params[0])
-        
+            # Remove stowed arm noise median and store current noise
+            self.point = self.pipeline.prepare_point(i, spectrum_raw, None if self.ray_mask is None else self.ray_mask[i])
+            self.spectrum_stowed_arm_removed = self.point.spectrum_stowed_arm_removed
+            self.cur_noise = self.point.noise
+
+            # Calculate and remove a baseline, fit a gaussian curve and calculate SNR of the fit
+            self._fit_point()
+
             # Determine if the point should be approved
-            self.approved = (min(self.SNR_stowed, self.SNR_silent) > self.SNR_THRESHOLD
-                            and self.r_squared > self.R_SQUARED_THRESHOLD 
-                            and self.FWHM > self.FWHM_MIN and self.FWHM < self.FWHM_MAX
-                            and self.peak_params[1] > self.CENTER - self.CENTER_RANGE
-                            and self.peak_params[1] < self.CENTER + self.CENTER_RANGE)
+            self.approved = self.point.approved
 
             if self.display_func(max(self.SNR_stowed, self.SNR_silent), self.r_squared, self.FWHM):
                 # Enable update buttons
@@ -811,15 +730,15 @@ class MainApp:
                 self.button_event.wait()
                 self.button_event.clear()
 
-            # Update the dataframes
-            append_df(i)
+            # Update the result tables
+            append_result(i)
 
             # Update the progress bar value and label text
             self.progress_bar["value"] = i + 1
             self.progress_label.config(text=f"  Point {i + 1}/99")
 
-        # Export dataframes
-        export_dfs()
+        # Export result tables
+        export_results()
 
         # Recenter the main frame
         self.main_frame.grid(row=0, column=0, sticky='news')
@@ -0,0 +1,120 @@
+import numpy as np
+import os
+
+import Helper
+
+# Settings a stored fit depends on, fits are only reclassified by a pipeline with the same values
+FIT_SETTINGS = ["CENTER", "NOISE_SAMPLE", "BASELINE_METHOD", "COSMIC_RAY_THRESHOLD", "PEAK_GUESS"]
+
+class FitStore:
+    def __init__(self, store_path):
+        """
+        Binary store of the raw fit of every point of every scan the automatic check has run on. Each scan and
+        mineral is one compressed .npz file holding the fit parameters, covariance, FWHM, R squared, both SNRs and
+        the sampling and smoothing of every point, along with the settings the fits depend on. Thresholds can
+        then be applied again to the stored fits without baselining or fitting anything.
+
+        store_path: string with directory to store the fits in, created if needed (ex: User/FitStore)
+        """
+        self.store_path = store_path
+
+    def entry_path(self, mineral_name, file_path):
+        """
+        Returns the path of the store entry of a scan and mineral.
+
+        mineral_name: name of the mineral the scan was fit for
+        file_path: string with directory to the Full Map ZNZ csv file the fits came from
+        """
+        return os.path.join(self.store_path, mineral_name, Helper.scan_entry_name(file_path) + ".npz")
+
+    def save(self, pipeline, file_path, results):
+        """
+        Stores the fits of every point of a scan, replacing an earlier entry of the same scan and mineral. The
+        entry is written to a temporary file first and renamed into place so a reader never sees a partial entry.
+        Returns the path of the entry.
+
+        pipeline: Pipeline.SpectrumPipeline the scan was fit with
+        file_path: string with directory to the Full Map ZNZ csv file the fits came from
+        results: list of fitted PointResults of the scan
+        """
+        entry_path = self.entry_path(pipeline.MINERAL_NAME, file_path)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+
+        fits = {
+            "point" : np.array([result.point_index for result in results], dtype=np.int32),
+            "peak_params" : np.array([result.peak_params for result in results], dtype=np.float64).reshape(-1, 3),
+            "cov" : np.array([result.cov for result in results], dtype=np.float64).reshape(-1, 3, 3),
+            "FWHM" : np.array([result.FWHM for result in results], dtype=np.float64),
+            "r_squared" : np.array([result.r_squared for result in results], dtype=np.float64),
+            "SNR_stowed" : np.array([result.SNR_stowed for result in results], dtype=np.float64),
+            "SNR_silent" : np.array([result.SNR_silent for result in results], dtype=np.float64),
+            "sampling" : np.array([result.sampling for result in results], dtype=np.int32),
+            "smoothing" : np.array([result.smoothing for result in results], dtype=np.int32),
+            "file_path" : np.array(os.path.abspath(file_path))
+        }
+        for setting in FIT_SETTINGS:
+            fits[setting] = np.array(getattr(pipeline, setting))
+
+        # Points the prescreen skipped could not pass this SNR_THRESHOLD with a center within this CENTER_RANGE, 0
+        # and infinity when every point was fit
+        fits["PRESCREEN_SNR"] = np.array(pipeline.SNR_THRESHOLD if pipeline.prescreen else 0.0, dtype=np.float64)
+        fits["PRESCREEN_RANGE"] = np.array(pipeline.CENTER_RANGE if pipeline.prescreen else np.inf, dtype=np.float64)
+
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            np.savez_compressed(file, **fits)
+        os.replace(temp_path, entry_path)
+
+        return entry_path
+
+    def entries(self, mineral_name):
+        """
+        Returns a sorted list of the entry paths stored for a mineral.
+
+        mineral_name: name of the mineral
+        """
+        mineral_path = os.path.join(self.store_path, mineral_name)
+        if not os.path.isdir(mineral_path):
+            return []
+
+        return sorted(os.path.join(mineral_path, name) for name in os.listdir(mineral_path) if name.endswith(".npz"))
+
+    @staticmethod
+    def load(entry_path):
+        """
+        Reads a store entry. Returns a dictionary of the stored arrays, with the file path and settings as plain
+        values.
+
+        entry_path: string with directory to an entry .npz file
+        """
+        with np.load(entry_path) as entry:
+            fits = {name: entry[name] for name in entry.files}
+
+        # Entries written before the PEAK_GUESS setting always started from the default guess
+        if "PEAK_GUESS" not in fits:
+            fits["PEAK_GUESS"] = np.array("default")
+        if "PRESCREEN_SNR" not in fits:
+            fits["PRESCREEN_SNR"] = np.array(0.0)
+        if "PRESCREEN_RANGE" not in fits:
+            fits["PRESCREEN_RANGE"] = np.array(np.inf)
+
+        for name in ["file_path", "PRESCREEN_SNR", "PRESCREEN_RANGE"] + FIT_SETTINGS:
+            fits[name] = fits[name].item()
+
+        return fits
+
+    @staticmethod
+    def matches(pipeline, fits):
+        """
+        Returns True if stored fits were made with the same fit settings, sampling and smoothing as a pipeline, so
+        its thresholds can be applied to them. Fits that skipped points with the prescreen only match pipelines with
+        an SNR_THRESHOLD at least as high and a CENTER_RANGE no wider than the ones the prescreen used.
+
+        pipeline: Pipeline.SpectrumPipeline whose thresholds will be applied
+        fits: dictionary of stored arrays from load
+        """
+        same_baseline = np.all(fits["sampling"] == pipeline.MHW) and np.all(fits["smoothing"] == pipeline.SHW)
+        if fits["PRESCREEN_SNR"] > pipeline.SNR_THRESHOLD or fits["PRESCREEN_RANGE"] < pipeline.CENTER_RANGE:
+            return False
+
+        return bool(same_baseline) and all(fits[setting] == getattr(pipeline, setting) for setting in FIT_SETTINGS)
@@ -0,0 +1,146 @@
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+import Batch
+import Helper
+import Pipeline
+
+# Columns of the sweep table, one row per sampling and smoothing pair
+SWEEP_COLUMNS = ["SAMPLING", "SMOOTHING", "Points", "Approved", "Approved %", "Median R^2", "Median Stowed SNR", "Median Silent SNR", "Seconds"]
+
+# Pipeline and cleaned scans of the current process, set once per worker by _init_worker
+_worker_pipeline = None
+_worker_scans = None
+
+def _init_worker(pipeline, scans):
+    """
+    Stores the pipeline and cleaned scans every grid cell of this process is evaluated on.
+
+    pipeline: Pipeline.SpectrumPipeline with the settings being tuned
+    scans: list of (ramanshift, cleaned scan) tuples, the cleaned scans from SpectrumPipeline.clean_scan
+    """
+    global _worker_pipeline, _worker_scans
+    _worker_pipeline = pipeline
+    _worker_scans = scans
+
+def _run_cell(cell):
+    """
+    Baselines and fits every scan with one sampling and smoothing pair. Returns a row of the sweep table.
+
+    cell: (sampling, smoothing) tuple
+    """
+    cell_start = time.perf_counter()
+    pipeline = _worker_pipeline.with_sampling(*cell)
+
+    r_squared = []
+    SNR_stowed = []
+    SNR_silent = []
+    approved = 0
+    for ramanshift, cleaned_scan in _worker_scans:
+        for result in pipeline.fit_scan(ramanshift, pipeline.baseline_cleaned(cleaned_scan)):
+            r_squared.append(result.r_squared)
+            SNR_stowed.append(result.SNR_stowed)
+            SNR_silent.append(result.SNR_silent)
+            approved += result.approved
+
+    points = len(r_squared)
+
+    return {
+        "SAMPLING" : cell[0],
+        "SMOOTHING" : cell[1],
+        "Points" : points,
+        "Approved" : approved,
+        "Approved %" : 100 * approved / points if points > 0 else 0,
+        "Median R^2" : np.median(r_squared) if points > 0 else np.nan,
+        "Median Stowed SNR" : np.median(SNR_stowed) if points > 0 else np.nan,
+        "Median Silent SNR" : np.median(SNR_silent) if points > 0 else np.nan,
+        "Seconds" : time.perf_counter() - cell_start
+    }
+
+def run_sweep(user_path, samplings, smoothings, scans=None, workers=1, cache_bytes=1024**3, batch_fit=False, mineral=None):
+    """
+    Runs the automatic check on a set of scans once for every pair of sampling and smoothing values and exports a
+    table of how each pair did to the Sweep results folder. Every scan is parsed, stowed arm subtracted and
+    cleaned of cosmic rays once, and the stowed arm noise is computed once, then shared by all of the pairs.
+    Pairs are spread across a pool of worker processes when workers is more than 1. Returns the sweep dataframe
+    with the SWEEP_COLUMNS, in grid order.
+
+    user_path: string with directory to the User folder
+    samplings: list of SAMPLING (max half window) values to try
+    smoothings: list of SMOOTHING (smooth half window) values to try
+    scans: list of Full Map ZNZ csv file paths, defaults to every scan in the Data folder
+    workers: number of processes to spread the pairs across
+    cache_bytes: maximum size of the User/Cache folder parsed Full Map files are cached in, 0 disables it
+    batch_fit: fit every point of a scan at once with Auto.perform_peakfit_batch
+    mineral: MINERAL_NAME of the Settings.csv row to tune, defaults to the first row
+    """
+    if scans is None:
+        scans = Batch.find_scans(user_path)
+
+    pipelines = Pipeline.MineralPipelines.from_user_folder(user_path, cache_bytes, batch_fit).pipelines
+    matching = [pipeline for pipeline in pipelines if mineral is None or pipeline.MINERAL_NAME == mineral]
+    if len(matching) == 0:
+        raise ValueError(f"No Settings.csv row has the MINERAL_NAME '{mineral}'")
+    pipeline = matching[0]
+
+    # Everything before baselining is shared by every pair
+    sweep_start = time.perf_counter()
+    cleaned_scans = []
+    for file_path in scans:
+        ramanshift, spectrums = pipeline.load_scan(file_path)
+        positions = pipeline.load_positions(file_path, len(spectrums))
+        pipeline.noise_library.stowed_std(pipeline.NOISE_SAMPLE, ramanshift, pipeline.CENTER)
+        cleaned_scans.append((ramanshift, pipeline.clean_scan(spectrums, positions)))
+
+    print(f"Loaded {len(scans)} scans in {time.perf_counter() - sweep_start:.2f} s")
+
+    cells = list(itertools.product(samplings, smoothings))
+    if workers > 1 and len(cells) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(pipeline, cleaned_scans)) as executor:
+            rows = list(executor.map(_run_cell, cells))
+    else:
+        _init_worker(pipeline, cleaned_scans)
+        rows = [_run_cell(cell) for cell in cells]
+
+    sweep_df = pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+    sweep_file = Helper.export_sweep(sweep_df, pipeline.MINERAL_NAME, user_path)
+
+    print(sweep_df.to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+    print(f"Swept {len(cells)} settings over {len(scans)} scans in {time.perf_counter() - sweep_start:.2f} s with {workers} worker(s), saved to {sweep_file}")
+
+    return sweep_df
+
+def main(argv=None):
+    """
+    Command line entry point for sweeping the sampling and smoothing settings.
+
+    argv: list of command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Run the SHERLOC automatic check over a grid of SAMPLING and SMOOTHING values.")
+    parser.add_argument("--user", default=os.path.join(os.getcwd(), "User"), help="path to the User folder (default: ./User)")
+    parser.add_argument("--sampling", type=int, nargs="+", required=True, help="SAMPLING values to try")
+    parser.add_argument("--smoothing", type=int, nargs="+", required=True, help="SMOOTHING values to try")
+    parser.add_argument("--scan", action="append", help="Full Map file to sweep over, can be repeated (default: every scan in User/Data)")
+    parser.add_argument("--mineral", help="MINERAL_NAME of the Settings.csv row to tune (default: the first row)")
+    parser.add_argument("--workers", type=int, default=1, help="number of settings to run in parallel (default: 1)")
+    parser.add_argument("--no-cache", action="store_true", help="always parse Full Map files instead of using User/Cache")
+    parser.add_argument("--cache-size", type=int, default=1024, help="maximum size of User/Cache in MB (default: 1024)")
+    parser.add_argument("--batch-fit", action="store_true", help="fit every point of a scan at once instead of one at a time")
+    args = parser.parse_args(argv)
+
+    scans = args.scan or Batch.find_scans(args.user)
+    if len(scans) == 0:
+        print("No Full Map files found in " + os.path.join(args.user, "Data"))
+        return
+
+    cache_bytes = 0 if args.no_cache else args.cache_size * 1024**2
+    run_sweep(args.user, args.sampling, args.smoothing, scans, max(args.workers, 1), cache_bytes, args.batch_fit, args.mineral)
+
+if __name__ == "__main__":
+    main()